@@ -2,49 +2,121 @@
 Script to create tables for existing stores that don't have them
 """
 
+import io
 import os
+import sqlite3
 import sys
+from contextlib import redirect_stdout
 from pathlib import Path
 
-import django
-
 # Add project root to path
 project_root = Path(__file__).resolve().parent
 sys.path.insert(0, str(project_root))
 
-# Setup Django
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "imagehost.settings")
-django.setup()
+from images.sqlite_maintenance import DB_PATH
 
-from django.db import connection
+# Tables and indexes every store must have (see images/store_tables.py)
+REQUIRED_SCHEMA_NAMES = (
+    "store_{}_categories",
+    "idx_store_{}_images_code_unique",
+    "idx_store_{}_categories_name",
+    "idx_store_{}_products_category_name",
+    "idx_store_{}_products_name",
+    "idx_store_{}_images_product_created",
+)
 
-from images.models import Store
-from images.store_tables import create_store_tables
 
-# Create tables for all existing stores that don't have them
-stores = Store.objects.all()
-print("Creating tables for existing stores...")
-print("=" * 70)
+def stores_up_to_date():
+    """
+    Check with plain sqlite3 whether every store already has its tables and
+    indexes, so the common "nothing to do" run can skip django.setup().
+    """
+    if not DB_PATH.exists():
+        return False
 
-for store in stores:
-    with connection.cursor() as cursor:
-        # Check if categories table exists
-        table_name = f"store_{store.id}_categories"
-        sql = (
-            "SELECT name FROM sqlite_master WHERE type='table' AND name = '{}'".format(
-                table_name
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        store_ids = [row[0] for row in conn.execute("SELECT id FROM images_store")]
+        existing = {
+            row[0]
+            for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE name LIKE '%store\\_%' ESCAPE '\\'"
             )
-        )
-        cursor.execute(sql)
-        if not cursor.fetchone():
-            print(f"Creating tables for store {store.id} ({store.name})...")
-            try:
-                create_store_tables(store.id)
-                print(f"✓ Created tables for store {store.id} ({store.name})")
-            except Exception as e:
-                print(f"✗ Error creating tables for store {store.id}: {e}")
-        else:
-            print(f"✓ Store {store.id} ({store.name}) already has tables")
-
-print("=" * 70)
-print("Done!")
+        }
+    except sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+
+    return all(
+        name.format(store_id) in existing
+        for store_id in store_ids
+        for name in REQUIRED_SCHEMA_NAMES
+    )
+
+
+def create_missing_tables():
+    """Create tables for all existing stores that don't have them"""
+    import django
+
+    # Setup Django
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "imagehost.settings")
+    django.setup()
+
+    from django.db import transaction
+
+    from images.models import Store
+    from images.store_tables import (
+        create_store_indexes,
+        create_store_tables,
+        get_store_table_names,
+        optimize_database,
+        store_table_name,
+    )
+
+    stores = Store.objects.only("id", "name").iterator(chunk_size=500)
+    print("Creating tables for existing stores...")
+    print("=" * 70)
+
+    # Look up every existing store table once instead of once per store
+    existing = get_store_table_names()
+
+    # Create all missing tables in one transaction (a savepoint per store keeps
+    # a failing store from rolling back the others)
+    with transaction.atomic():
+        for store in stores:
+            if store_table_name(store.id, "categories") not in existing:
+                print(f"Creating tables for store {store.id} ({store.name})...")
+                try:
+                    with transaction.atomic():
+                        create_store_tables(store.id)
+                    print(f"✓ Created tables for store {store.id} ({store.name})")
+                except Exception as e:
+                    print(f"✗ Error creating tables for store {store.id}: {e}")
+            else:
+                print(f"✓ Store {store.id} ({store.name}) already has tables")
+                # Backfill indexes (e.g. images.product_id) on older stores
+                try:
+                    with transaction.atomic():
+                        create_store_indexes(store.id)
+                except Exception as e:
+                    print(f"✗ Error creating indexes for store {store.id}: {e}")
+
+    optimize_database()
+
+    print("=" * 70)
+    print("Done!")
+
+
+if __name__ == "__main__":
+    if stores_up_to_date():
+        print("All stores already have their tables and indexes. Nothing to do.")
+        sys.exit(0)
+
+    # Collect the per-store progress lines and write them out with one call
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output):
+            create_missing_tables()
+    finally:
+        sys.stdout.write(output.getvalue())
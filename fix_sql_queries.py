@@ -4,56 +4,59 @@ Script to fix all f-string SQL queries in store_helpers.py
 
 import re
 
-# Read the file
-with open("images/store_helpers.py", "r") as f:
-    lines = f.readlines()
-
-new_lines = []
-i = 0
-while i < len(lines):
-    line = lines[i]
-
-    # Check if this is an f-string SQL query
-    if 'cursor.execute(f"' in line or "cursor.execute(f'" in line:
-        # Find the full statement (might span multiple lines)
-        full_stmt = line
-        j = i + 1
-        while j < len(lines) and (
-            full_stmt.count("(") > full_stmt.count(")") or full_stmt.count('"') % 2 != 0
-        ):
-            full_stmt += lines[j]
-            j += 1
-
-        # Extract the SQL and params
-        match = re.search(
-            r'cursor\.execute\(f["\']([^"\']*)\{([^\}]+)\}([^"\']*)["\'],\s*([^\)]+)\)',
-            full_stmt,
+# Matches a (possibly multi-line) cursor.execute(f"...{var}...", params) call
+# with exactly one placeholder
+FSTRING_EXECUTE = re.compile(
+    r'^([ \t]*)cursor\.execute\(\s*f(["\'])((?:(?!\2)[^{])*)\{([^}]+)\}'
+    r'((?:(?!\2)[^{])*)\2,\s*([^)]+?)\s*\)',
+    re.MULTILINE | re.DOTALL,
+)
+
+# SQL contexts where SQLite accepts a bind parameter (i.e. a value, not an identifier)
+VALUE_POSITION = re.compile(
+    r"(?:[=<>]|\bLIKE|\bIN\s*\(|\bVALUES\s*\(|\bLIMIT|\bOFFSET)\s*'?$",
+    re.IGNORECASE,
+)
+
+
+def to_parameterized_call(match):
+    """
+    Rewrite an f-string execute() call.
+    Values become ? bind parameters so SQLite can reuse the prepared statement;
+    identifiers (table names) fall back to sql = "...".format(var).
+    """
+    indent, _, before, var, after, params = match.groups()
+
+    if VALUE_POSITION.search(before):
+        # Drop the SQL quotes around a quoted value: '{var}' -> ?
+        if before.endswith("'") and after.startswith("'"):
+            before, after = before[:-1], after[1:]
+        # Insert the value at its position among the existing ? params
+        index = before.count("?")
+        if index:
+            params = f"[*{params}[:{index}], {var}, *{params}[{index}:]]"
+        else:
+            params = f"[{var}, *{params}]"
+        return (
+            f'{indent}sql = "{before}?{after}"\n'
+            f"{indent}cursor.execute(sql, {params})"
         )
-        if match:
-            before = match.group(1)
-            var = match.group(2)
-            after = match.group(3)
-            params = match.group(4).strip()
 
-            # Create new format
-            sql_line = f'                sql = "{before}{{}}{after}".format({var})'
-            exec_line = f"                cursor.execute(sql, {params})"
+    return (
+        f'{indent}sql = "{before}{{}}{after}".format({var})\n'
+        f"{indent}cursor.execute(sql, {params})"
+    )
 
-            # Add proper indentation
-            indent = len(line) - len(line.lstrip())
-            sql_line = " " * indent + sql_line.lstrip()
-            exec_line = " " * indent + exec_line.lstrip()
 
-            new_lines.append(sql_line + "\n")
-            new_lines.append(exec_line + "\n")
-            i = j
-            continue
+# Read the file
+with open("images/store_helpers.py", "r") as f:
+    source = f.read()
 
-    new_lines.append(line)
-    i += 1
+# Rewrite every matching statement in a single pass
+fixed = FSTRING_EXECUTE.sub(to_parameterized_call, source)
 
 # Write back
 with open("images/store_helpers.py", "w") as f:
-    f.writelines(new_lines)
+    f.write(fixed)
 
 print("Fixed SQL queries")
@@ -74,9 +74,18 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Keep connections open between requests so each one doesn't reopen
+        # the file and re-run the PRAGMAs from images/apps.py
+        "CONN_MAX_AGE": 60,
+        "CONN_HEALTH_CHECKS": True,
         "OPTIONS": {
             # Disable SQL query logging to avoid conflicts with our SQL formatting
             "timeout": 20,
+            # sqlite3 keeps prepared statements per connection keyed by SQL
+            # text; every store has its own tables and statements, so the
+            # default of 128 is evicted long before the persistent
+            # connection is closed
+            "cached_statements": 1024,
         },
     }
 }
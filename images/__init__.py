@@ -1,2 +1,2 @@
 # Patch Django's debug SQL logging to avoid conflicts with our SQL formatting
-# This is applied automatically when the app is loaded
+# This is applied automatically when the app is loaded with DEBUG enabled
@@ -2,53 +2,80 @@
 Migration script to add description column to existing product tables
 """
 
-import os
+import io
 import sys
+from contextlib import redirect_stdout
 from pathlib import Path
 
-import django
-
 # Add project root to path
 project_root = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(project_root))
 
-# Setup Django
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "imagehost.settings")
-django.setup()
+from images.sqlite_maintenance import (
+    apply_statements,
+    connect,
+    get_stores,
+    get_table_columns,
+    optimize,
+    store_table_name,
+)
+
+ADD_DESCRIPTION_SQL = "ALTER TABLE {} ADD COLUMN description TEXT"
+
+
+def description_column_statements(table_name, columns):
+    """Return the ALTER statements needed for a specific store's products table"""
+    if columns is None:
+        print(f"  {table_name} does not exist, skipping")
+        return []
+
+    # Add description if it doesn't exist
+    if "description" not in columns:
+        return [ADD_DESCRIPTION_SQL.format(table_name)]
 
-from django.db import connection
+    print(f"  description column already exists in {table_name}")
+    return []
 
-from images.models import Store
 
+def add_description_columns():
+    """Add description column to all existing stores"""
+    conn = connect()
+    print("Adding description column to existing product tables...")
+    print("=" * 70)
 
-def add_description_column_to_store(store_id):
-    """Add description column to a specific store's products table"""
-    with connection.cursor() as cursor:
-        table_name = f"store_{store_id}_products"
+    # Read the columns of every products table in one query
+    existing_columns = get_table_columns(conn, "products")
 
-        # Check if column already exists
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        columns = [row[1] for row in cursor.fetchall()]
+    statements = []
+    for store_id, store_name in get_stores(conn):
+        print(f"\nStore {store_id} ({store_name}):")
+        table_name = store_table_name(store_id, "products")
+        statements.extend(
+            description_column_statements(table_name, existing_columns.get(table_name))
+        )
 
-        # Add description if it doesn't exist
-        if "description" not in columns:
-            try:
-                cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN description TEXT")
-                print(f"✓ Added description column to {table_name}")
-            except Exception as e:
-                print(f"✗ Error adding description to {table_name}: {e}")
-        else:
-            print(f"  description column already exists in {table_name}")
+    # Apply every ALTER in a single transaction (one commit instead of one per table)
+    if statements:
+        try:
+            apply_statements(conn, statements)
+            print(f"\n✓ Added description column to {len(statements)} table(s)")
+        except Exception as e:
+            print(
+                f"\n✗ Error adding description columns, no tables were changed: {e}"
+            )
 
+    optimize(conn)
+    conn.close()
 
-# Add description column to all existing stores
-stores = Store.objects.all()
-print("Adding description column to existing product tables...")
-print("=" * 70)
+    print("=" * 70)
+    print("Done!")
 
-for store in stores:
-    print(f"\nStore {store.id} ({store.name}):")
-    add_description_column_to_store(store.id)
 
-print("=" * 70)
-print("Done!")
+if __name__ == "__main__":
+    # Collect the per-store progress lines and write them out with one call
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output):
+            add_description_columns()
+    finally:
+        sys.stdout.write(output.getvalue())
@@ -2,67 +2,89 @@
 Migration script to add price columns to existing product tables
 """
 
-import os
+import io
 import sys
+from contextlib import redirect_stdout
 from pathlib import Path
 
-import django
-
 # Add project root to path
 project_root = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(project_root))
 
-# Setup Django
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "imagehost.settings")
-django.setup()
-
-from django.db import connection
-
-from images.models import Store
-
-
-def add_price_columns_to_store(store_id):
-    """Add price columns to a specific store's products table"""
-    with connection.cursor() as cursor:
-        table_name = f"store_{store_id}_products"
-
-        # Check if columns already exist
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        columns = [row[1] for row in cursor.fetchall()]
-
-        # Add marked_price if it doesn't exist
-        if "marked_price" not in columns:
-            try:
-                cursor.execute(
-                    f"ALTER TABLE {table_name} ADD COLUMN marked_price DECIMAL(10, 2)"
-                )
-                print(f"✓ Added marked_price column to {table_name}")
-            except Exception as e:
-                print(f"✗ Error adding marked_price to {table_name}: {e}")
-        else:
-            print(f"  marked_price column already exists in {table_name}")
-
-        # Add min_discounted_price if it doesn't exist
-        if "min_discounted_price" not in columns:
-            try:
-                cursor.execute(
-                    f"ALTER TABLE {table_name} ADD COLUMN min_discounted_price DECIMAL(10, 2)"
-                )
-                print(f"✓ Added min_discounted_price column to {table_name}")
-            except Exception as e:
-                print(f"✗ Error adding min_discounted_price to {table_name}: {e}")
-        else:
-            print(f"  min_discounted_price column already exists in {table_name}")
-
-
-# Add price columns to all existing stores
-stores = Store.objects.all()
-print("Adding price columns to existing product tables...")
-print("=" * 70)
-
-for store in stores:
-    print(f"\nStore {store.id} ({store.name}):")
-    add_price_columns_to_store(store.id)
-
-print("=" * 70)
-print("Done!")
+from images.sqlite_maintenance import (
+    apply_statements,
+    connect,
+    get_stores,
+    get_table_columns,
+    optimize,
+    store_table_name,
+)
+
+ADD_PRICE_COLUMN_SQL = "ALTER TABLE {} ADD COLUMN {} DECIMAL(10, 2)"
+
+
+def price_column_statements(table_name, columns):
+    """Return the ALTER statements needed for a specific store's products table"""
+    if columns is None:
+        print(f"  {table_name} does not exist, skipping")
+        return []
+
+    statements = []
+
+    # Add marked_price if it doesn't exist
+    if "marked_price" not in columns:
+        statements.append(ADD_PRICE_COLUMN_SQL.format(table_name, "marked_price"))
+    else:
+        print(f"  marked_price column already exists in {table_name}")
+
+    # Add min_discounted_price if it doesn't exist
+    if "min_discounted_price" not in columns:
+        statements.append(
+            ADD_PRICE_COLUMN_SQL.format(table_name, "min_discounted_price")
+        )
+    else:
+        print(f"  min_discounted_price column already exists in {table_name}")
+
+    return statements
+
+
+def add_price_columns():
+    """Add price columns to all existing stores"""
+    conn = connect()
+    print("Adding price columns to existing product tables...")
+    print("=" * 70)
+
+    # Read the columns of every products table in one query
+    existing_columns = get_table_columns(conn, "products")
+
+    statements = []
+    for store_id, store_name in get_stores(conn):
+        print(f"\nStore {store_id} ({store_name}):")
+        table_name = store_table_name(store_id, "products")
+        statements.extend(
+            price_column_statements(table_name, existing_columns.get(table_name))
+        )
+
+    # Apply every ALTER in a single transaction (one commit instead of one per column)
+    if statements:
+        try:
+            apply_statements(conn, statements)
+            print(f"\n✓ Applied {len(statements)} price column change(s)")
+        except Exception as e:
+            print(f"\n✗ Error adding price columns, no tables were changed: {e}")
+
+    optimize(conn)
+    conn.close()
+
+    print("=" * 70)
+    print("Done!")
+
+
+if __name__ == "__main__":
+    # Collect the per-store progress lines and write them out with one call
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output):
+            add_price_columns()
+    finally:
+        sys.stdout.write(output.getvalue())
@@ -1,60 +1,79 @@
 
+import io
 import os
 import sys
-import django
+from contextlib import redirect_stdout
 
-# Setup Django environment
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "imagehost.settings")
-django.setup()
 
-from django.db import connection
-from images.models import Store
+from images.sqlite_maintenance import (
+    apply_statements,
+    connect,
+    get_stores,
+    get_table_columns,
+    optimize,
+    store_table_name,
+)
+
+ADD_URL_SQL = "ALTER TABLE {} ADD COLUMN url VARCHAR(500)"
 
 def add_url_column():
     """Add url column to all store image tables"""
     print("Starting migration to add 'url' column...")
     
-    stores = Store.objects.all()
+    conn = connect()
     count = 0
     updated = 0
+    statements = []
     
-    with connection.cursor() as cursor:
-        for store in stores:
-            table_name = f"store_{store.id}_images"
-            print(f"Checking table {table_name}...")
-            
-            # Check if table exists
-            cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
-            if not cursor.fetchone():
-                print(f"Table {table_name} does not exist, skipping.")
-                continue
-                
-            # Check if column exists
-            cursor.execute(f"PRAGMA table_info({table_name})")
-            columns = [col[1] for col in cursor.fetchall()]
-            
-            if "url" not in columns:
-                print(f"Adding 'url' column to {table_name}...")
-                try:
-                    cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN url VARCHAR(500)")
-                    updated += 1
-                except Exception as e:
-                    print(f"Error adding column to {table_name}: {e}")
-            else:
-                print(f"Column 'url' already exists in {table_name}.")
-            
-            # Also make sure image_file allows NULL (SQLite columns are nullable by default usually unless strict)
-            # We can't easily alter column nullability in SQLite without recreating table, 
-            # but standard ADD COLUMN creates nullable columns.
-            # existing image_file columns might have NOT NULL constraint if created that way.
-            # If so, we might need to handle that if we want to support 'only URL' images.
-            # However, for now let's assume we can tolerate empty string or dummy value if strictly needed,
-            # or rely on SQLite's lax typing if not in strict mode.
+    # Read the columns of every images table in one query
+    existing_columns = get_table_columns(conn, "images")
+
+    for store_id, _ in get_stores(conn):
+        table_name = store_table_name(store_id, "images")
+        print(f"Checking table {table_name}...")
+        
+        # Check if table exists
+        columns = existing_columns.get(table_name)
+        if columns is None:
+            print(f"Table {table_name} does not exist, skipping.")
+            continue
             
-            count += 1
+        # Check if column exists
+        if "url" not in columns:
+            print(f"Queueing 'url' column for {table_name}...")
+            statements.append(ADD_URL_SQL.format(table_name))
+        else:
+            print(f"Column 'url' already exists in {table_name}.")
+        
+        # Also make sure image_file allows NULL (SQLite columns are nullable by default usually unless strict)
+        # We can't easily alter column nullability in SQLite without recreating table, 
+        # but standard ADD COLUMN creates nullable columns.
+        # existing image_file columns might have NOT NULL constraint if created that way.
+        # If so, we might need to handle that if we want to support 'only URL' images.
+        # However, for now let's assume we can tolerate empty string or dummy value if strictly needed,
+        # or rely on SQLite's lax typing if not in strict mode.
+        
+        count += 1
+
+    # Apply all ALTERs in one transaction so the whole run commits once
+    if statements:
+        try:
+            apply_statements(conn, statements)
+            updated = len(statements)
+        except Exception as e:
+            print(f"Error adding 'url' column, no tables were changed: {e}")
             
+    optimize(conn)
+    conn.close()
+
     print(f"\nMigration complete. Checked {count} stores. Updated {updated} tables.")
 
 if __name__ == "__main__":
-    add_url_column()
+    # Collect the per-store progress lines and write them out with one call
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output):
+            add_url_column()
+    finally:
+        sys.stdout.write(output.getvalue())
@@ -1,12 +1,10 @@
 from django.contrib import admin
-from django.utils.safestring import mark_safe
+from django.db.models import Count
+from django.utils.html import format_html, format_html_join
 
 from .models import Category, Image, Product, Store
-from .store_models import (
-    get_store_category_model,
-    get_store_image_model,
-    get_store_product_model,
-)
+from .store_models import get_store_models
+from .store_tables import count_store_rows, get_store_counts
 
 
 @admin.register(Store)
@@ -23,12 +21,20 @@ class StoreAdmin(admin.ModelAdmin):
     # Add the inventory display to the readonly fields so it appears on the detail page
     readonly_fields = ["store_inventory_display"]
 
+    def get_changelist_instance(self, request):
+        """Load product/image counts for every store on the page in one query"""
+        changelist = super().get_changelist_instance(request)
+        counts = get_store_counts([store.id for store in changelist.result_list])
+        for store in changelist.result_list:
+            store._product_count, store._image_count = counts[store.id]
+        return changelist
+
     def get_product_count(self, obj):
         """Display number of products in the store list view"""
+        if hasattr(obj, "_product_count"):
+            return obj._product_count
         try:
-            CategoryModel = get_store_category_model(obj.id)
-            ProductModel = get_store_product_model(obj.id, CategoryModel)
-            return ProductModel.objects.count()
+            return count_store_rows(obj.id, "products")
         except Exception:
             return 0
 
@@ -36,11 +42,10 @@ class StoreAdmin(admin.ModelAdmin):
 
     def get_image_count(self, obj):
         """Display number of images in the store list view"""
+        if hasattr(obj, "_image_count"):
+            return obj._image_count
         try:
-            CategoryModel = get_store_category_model(obj.id)
-            ProductModel = get_store_product_model(obj.id, CategoryModel)
-            ImageModel = get_store_image_model(obj.id, ProductModel)
-            return ImageModel.objects.count()
+            return count_store_rows(obj.id, "images")
         except Exception:
             return 0
 
@@ -50,20 +55,48 @@ class StoreAdmin(admin.ModelAdmin):
         """Render a table of the store's products and images"""
         try:
             # Initialize dynamic models for this specific store
-            CategoryModel = get_store_category_model(obj.id)
-            ProductModel = get_store_product_model(obj.id, CategoryModel)
-            ImageModel = get_store_image_model(obj.id, ProductModel)
+            CategoryModel, ProductModel, ImageModel = get_store_models(obj.id)
 
-            # Fetch products with their categories and images
-            # Note: We can't use standard select_related for images as they are reverse FK,
-            # but we can prefetch or just access them if the model is initialized.
-            products = ProductModel.objects.all().select_related("category")
+            # Fetch products with their categories and per-product image counts
+            # in a single query (LEFT JOIN + GROUP BY on the product_id index)
+            products = (
+                ProductModel.objects.all()
+                .select_related("category")
+                .annotate(image_count=Count("images"))
+            )
 
-            if not products.exists():
+            if not products:
                 return "No products found in this store."
 
+            # Build the rows in one pass; format_html_join escapes every value
+            rows = format_html_join(
+                "",
+                """
+                    <tr>
+                        <td style="padding: 8px; border: 1px solid #ddd; font-weight: bold;">{}</td>
+                        <td style="padding: 8px; border: 1px solid #ddd;">{}</td>
+                        <td style="padding: 8px; border: 1px solid #ddd; text-align: right;">{}</td>
+                        <td style="padding: 8px; border: 1px solid #ddd; text-align: right;">{}</td>
+                        <td style="padding: 8px; border: 1px solid #ddd; text-align: center;">{}</td>
+                        <td style="padding: 8px; border: 1px solid #ddd; color: #666; font-size: 0.9em;">{}</td>
+                    </tr>
+                """,
+                (
+                    (
+                        p.name,
+                        p.category.name,
+                        p.marked_price or "-",
+                        p.min_discounted_price or "-",
+                        p.image_count,
+                        (p.description or "")[:100],
+                    )
+                    for p in products
+                ),
+            )
+
             # Build HTML table
-            html = """
+            return format_html(
+                """
             <div style="max-height: 600px; overflow-y: auto; border: 1px solid #eee;">
                 <table style="width: 100%; border-collapse: collapse;">
                     <thead style="background-color: #f5f5f5; position: sticky; top: 0;">
@@ -76,31 +109,12 @@ class StoreAdmin(admin.ModelAdmin):
                             <th style="padding: 10px; border: 1px solid #ddd; text-align: left;">Description</th>
                         </tr>
                     </thead>
-                    <tbody>
-            """
-
-            for p in products:
-                # Calculate image count
-                # The dynamic Image model relates to Product with related_name='images'
-                image_count = p.images.count()
-
-                html += f"""
-                    <tr>
-                        <td style="padding: 8px; border: 1px solid #ddd; font-weight: bold;">{p.name}</td>
-                        <td style="padding: 8px; border: 1px solid #ddd;">{p.category.name}</td>
-                        <td style="padding: 8px; border: 1px solid #ddd; text-align: right;">{p.marked_price or '-'}</td>
-                        <td style="padding: 8px; border: 1px solid #ddd; text-align: right;">{p.min_discounted_price or '-'}</td>
-                        <td style="padding: 8px; border: 1px solid #ddd; text-align: center;">{image_count}</td>
-                        <td style="padding: 8px; border: 1px solid #ddd; color: #666; font-size: 0.9em;">{(p.description or '')[:100]}</td>
-                    </tr>
-                """
-
-            html += """
-                    </tbody>
+                    <tbody>{}</tbody>
                 </table>
             </div>
-            """
-            return mark_safe(html)
+            """,
+                rows,
+            )
 
         except Exception as e:
             return f"Unable to load store data (Tables might not exist yet): {str(e)}"
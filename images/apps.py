@@ -1,4 +1,39 @@
+import atexit
+
 from django.apps import AppConfig
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.backends.signals import connection_created
+
+# Applied once to every new SQLite connection (WAL + relaxed fsync, bigger cache)
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA foreign_keys=ON",
+)
+
+
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """Apply performance PRAGMAs when a new SQLite connection is opened"""
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+
+
+def optimize_sqlite_connection():
+    """Run PRAGMA optimize on the default connection before shutdown"""
+    if connection.vendor != "sqlite" or connection.connection is None:
+        return
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA optimize")
+    except DatabaseError:
+        pass
 
 
 class ImagesConfig(AppConfig):
@@ -6,5 +41,13 @@ class ImagesConfig(AppConfig):
     name = "images"
 
     def ready(self):
-        """Apply debug SQL logging patch when app is ready"""
-        from . import debug_sql_patch  # noqa
+        """Apply debug SQL logging patch and SQLite tuning when app is ready"""
+        # CursorDebugWrapper is only used when DEBUG is on; otherwise the
+        # plain CursorWrapper runs and the patch would only add overhead
+        if settings.DEBUG:
+            from . import debug_sql_patch  # noqa
+
+        connection_created.connect(
+            configure_sqlite_connection, dispatch_uid="images_sqlite_pragmas"
+        )
+        atexit.register(optimize_sqlite_connection)
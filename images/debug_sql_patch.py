@@ -4,7 +4,7 @@ This prevents Django from trying to format SQL strings with % operator when our
 """
 
 from django.db.backends.sqlite3.operations import DatabaseOperations
-from django.db.backends.utils import CursorDebugWrapper
+from django.db.backends.utils import CursorDebugWrapper, CursorWrapper
 
 # Store original methods
 _original_execute = CursorDebugWrapper.execute
@@ -13,7 +13,9 @@ _original_last_executed_query = DatabaseOperations.last_executed_query
 
 def patched_execute(self, sql, params=None):
     """Patched execute that skips debug SQL logging"""
-    return self.cursor.execute(sql, params)
+    # Run the plain CursorWrapper path so database errors are still
+    # translated (e.g. sqlite3.IntegrityError -> django.db.IntegrityError)
+    return CursorWrapper.execute(self, sql, params)
 
 
 def patched_last_executed_query(self, cursor, sql, params):
@@ -1,7 +1,13 @@
+import re
+
 from django import forms
 
 from .models import Category, Image, Product, Store
 
+# Characters stripped from phone numbers (spaces, hyphens, brackets, ...)
+PHONE_STRIP_RE = re.compile(r"[^\d+]")
+PHONE_RE = re.compile(r"^\+?\d{7,15}$")
+
 
 class StoreForm(forms.ModelForm):
     class Meta:
@@ -33,11 +39,10 @@ class StoreForm(forms.ModelForm):
         number = self.cleaned_data.get("whatsapp_number")
         if number:
             # Strip spaces, hyphens, and brackets
-            import re
-            cleaned_number = re.sub(r"[^\d+]", "", number)
+            cleaned_number = PHONE_STRIP_RE.sub("", number)
             
             # Basic validation
-            if not re.match(r"^\+?\d{7,15}$", cleaned_number):
+            if not PHONE_RE.match(cleaned_number):
                 raise forms.ValidationError("Please enter a valid phone number (7-15 digits), optionally with + prefix.")
             
             return cleaned_number
@@ -0,0 +1,99 @@
+"""
+Migration script to add every missing column to existing store tables in one pass.
+Covers the changes of add_description_column.py, add_price_columns.py and
+add_url_column.py with a single schema scan and a single transaction.
+"""
+
+import io
+import os
+import sys
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import django
+
+# Add project root to path
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+# Setup Django
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "imagehost.settings")
+django.setup()
+
+from django.db import connection, transaction
+
+from images.models import Store
+from images.store_tables import (
+    get_store_table_columns,
+    optimize_database,
+    store_table_name,
+)
+
+# Columns every store table must have, per table suffix
+TARGET_COLUMNS = {
+    "products": [
+        ("description", "TEXT"),
+        ("marked_price", "DECIMAL(10, 2)"),
+        ("min_discounted_price", "DECIMAL(10, 2)"),
+    ],
+    "images": [
+        ("url", "VARCHAR(500)"),
+    ],
+}
+ADD_COLUMN_SQL = "ALTER TABLE {} ADD COLUMN {} {}"
+
+
+def missing_column_statements(store_ids):
+    """Return the ALTER statements needed to bring every store table up to date"""
+    statements = []
+    for suffix, target_columns in TARGET_COLUMNS.items():
+        # One query reads the columns of this table type for all stores
+        existing_columns = get_store_table_columns(suffix)
+        for store_id in store_ids:
+            table_name = store_table_name(store_id, suffix)
+            columns = existing_columns.get(table_name)
+            if columns is None:
+                print(f"  {table_name} does not exist, skipping")
+                continue
+            for column, column_type in target_columns:
+                if column not in columns:
+                    statements.append(
+                        ADD_COLUMN_SQL.format(table_name, column, column_type)
+                    )
+    return statements
+
+
+def migrate_columns():
+    """Add all missing columns to all store tables in one transaction"""
+    print("Adding missing columns to existing store tables...")
+    print("=" * 70)
+
+    store_ids = list(Store.objects.values_list("id", flat=True))
+    statements = missing_column_statements(store_ids)
+
+    if not statements:
+        print("All store tables are up to date.")
+    else:
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+                    print(f"✓ {sql}")
+            print(f"\nApplied {len(statements)} column change(s)")
+        except Exception as e:
+            print(f"✗ Error adding columns, no tables were changed: {e}")
+
+    optimize_database()
+
+    print("=" * 70)
+    print("Done!")
+
+
+if __name__ == "__main__":
+    # Collect the per-store progress lines and write them out with one call
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output):
+            migrate_columns()
+    finally:
+        sys.stdout.write(output.getvalue())
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.7 on 2026-10-16 02:24
+
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+def fill_url_slugs(apps, schema_editor):
+    Image = apps.get_model('images', 'Image')
+    images = list(Image.objects.select_related('product__category__store'))
+    for image in images:
+        image.store_slug = slugify(image.product.category.store.name)
+        image.category_slug = slugify(image.product.category.name)
+        image.product_slug = slugify(image.product.name)
+    Image.objects.bulk_update(
+        images, ['store_slug', 'category_slug', 'product_slug'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0004_store_logo_url_store_maps_photo_url_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='category_slug',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='product_slug',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='store_slug',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['product', 'image_code'], name='images_imag_product_a1d9d7_idx'),
+        ),
+        migrations.RunPython(fill_url_slugs, migrations.RunPython.noop),
+    ]
@@ -1,30 +1,98 @@
+import logging
 import os
 import re
-import sys
+import string
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from io import BytesIO
 
 from django.contrib.auth.models import User
+from django.core.files import File
 from django.core.files.uploadedfile import InMemoryUploadedFile
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Q
+from django.urls import reverse
+from django.utils.text import slugify
 from PIL import Image as PilImage
 
-
-def compress_image(image_field, quality=90):
-    """Compress the image field using Pillow"""
+# libvips is optional; compress_image falls back to Pillow without it
+try:
+    import pyvips
+except (ImportError, OSError):
+    pyvips = None
+
+logger = logging.getLogger(__name__)
+
+# JPEG uploads smaller than this are already compressed and stored untouched
+COMPRESS_SKIP_BYTES = 300 * 1024
+JPEG_MAGIC = b"\xff\xd8\xff"
+
+# How many times Image.save picks a new suffix after losing an image_code race
+IMAGE_CODE_RETRIES = 5
+
+# Patterns used to normalise image codes, compiled once at import
+NON_ALNUM_RE = re.compile(r"[^a-zA-Z0-9\s]")
+WHITESPACE_RE = re.compile(r"\s+")
+INVALID_CODE_RE = re.compile(r"[^a-z0-9_]")
+UNDERSCORES_RE = re.compile(r"_+")
+
+# ASCII translation table for generate_image_code: lowercase letters, keep
+# digits and whitespace, delete everything else
+IMAGE_CODE_TABLE = str.maketrans(
+    string.ascii_uppercase,
+    string.ascii_lowercase,
+    "".join(chr(c) for c in range(128) if not (chr(c).isalnum() or chr(c).isspace())),
+)
+
+# ASCII translation table for clean_image_code: lowercase letters, turn
+# whitespace into underscores, delete everything outside [a-z0-9_]
+CLEAN_CODE_TABLE = str.maketrans(
+    string.ascii_uppercase + string.whitespace + "\x1c\x1d\x1e\x1f",
+    string.ascii_lowercase + "_" * (len(string.whitespace) + 4),
+    "".join(
+        chr(c)
+        for c in range(128)
+        if not (chr(c).isalnum() or chr(c).isspace() or chr(c) == "_")
+    ),
+)
+
+
+def compress_image(image_field, quality=85):
+    """Compress the image field to JPEG using libvips, or Pillow if unavailable"""
     if not image_field:
         return
 
-    # Open image using Pillow
-    img = PilImage.open(image_field)
-
-    # Convert to RGB (in case of RGBA/P)
-    if img.mode != "RGB":
-        img = img.convert("RGB")
-
-    # Compress
-    output = BytesIO()
-    img.save(output, format="JPEG", quality=quality, optimize=True)
-    output.seek(0)
+    # Re-encoding a small JPEG only costs CPU and quality
+    if image_field.size < COMPRESS_SKIP_BYTES:
+        header = image_field.read(len(JPEG_MAGIC))
+        image_field.seek(0)
+        if header == JPEG_MAGIC:
+            return
+
+    if pyvips is not None:
+        # Convert to 3-band sRGB (in case of CMYK/mono/alpha) and encode
+        img = pyvips.Image.new_from_buffer(image_field.read(), "").colourspace("srgb")
+        if img.hasalpha():
+            img = img.extract_band(0, n=3)
+        output = BytesIO(img.jpegsave_buffer(Q=quality, strip=True, interlace=True))
+    else:
+        # Decode once with Pillow, releasing the decoder when done
+        with PilImage.open(image_field) as img:
+            # Convert to RGB (in case of RGBA/P)
+            rgb = img.convert("RGB") if img.mode != "RGB" else img
+
+            # Compress as a progressive, 4:2:0-subsampled JPEG
+            output = BytesIO()
+            rgb.save(
+                output,
+                format="JPEG",
+                quality=quality,
+                optimize=False,
+                progressive=True,
+                subsampling=2,
+            )
+        output.seek(0)
 
     # Update the image field
     image_field.file = InMemoryUploadedFile(
@@ -32,27 +100,146 @@ def compress_image(image_field, quality=90):
         "ImageField",
         f"{os.path.splitext(image_field.name)[0]}.jpg",
         "image/jpeg",
-        sys.getsizeof(output),
+        output.getbuffer().nbytes,
         None,
     )
 
 
+# Uploads are saved as-is and recompressed here, off the request thread.
+# Pillow and libvips release the GIL while encoding, so a store's logo,
+# payment QR and map photo are compressed in parallel.
+compression_executor = ThreadPoolExecutor(
+    max_workers=3, thread_name_prefix="compress_image"
+)
+
+
+def compress_stored_image(model, pk, field_name):
+    """Recompress a saved image file to JPEG and point the field at the result"""
+    try:
+        instance = model.objects.filter(pk=pk).first()
+        field_file = getattr(instance, field_name, None)
+        if not field_file:
+            return
+        old_name = field_file.name
+
+        with field_file.storage.open(old_name, "rb") as original:
+            upload = File(original, name=old_name)
+            compress_image(upload)
+            if upload.file is original:
+                return
+        field_file.save(os.path.basename(upload.file.name), upload.file, save=False)
+
+        # update() instead of save() so this doesn't queue another compression
+        updates = {field_name: field_file.name}
+        if model is Image:
+            updates["file_size"] = field_file.size
+        model.objects.filter(pk=pk).update(**updates)
+        if field_file.name != old_name:
+            field_file.storage.delete(old_name)
+    except Exception:
+        # Runs on a worker thread, so log with the traceback instead of printing
+        logger.exception(
+            "Compression failed for %s %s.%s", model.__name__, pk, field_name
+        )
+    finally:
+        connection.close()
+
+
+def schedule_compression(instance, field_name):
+    """Compress instance.<field_name> in the background after the save commits"""
+    args = (compress_stored_image, type(instance), instance.pk, field_name)
+    transaction.on_commit(lambda: compression_executor.submit(*args))
+
+
+def code_prefix_q(prefix):
+    """Filter for image codes starting with prefix that the unique index can serve"""
+    # Codes only contain [a-z0-9_], which all sort before "~"; a LIKE would
+    # be case-insensitive in SQLite and scan the whole table instead
+    return Q(image_code__gte=prefix, image_code__lt=prefix + "~")
+
+
+@lru_cache(maxsize=4096)
+def cached_slugify(name):
+    """slugify() memoized for store/category/product names shared by many images"""
+    return slugify(name)
+
+
+@lru_cache(maxsize=4096)
 def generate_image_code(filename):
     """Generate image code from filename: lowercase, words separated by underscores"""
     # Remove file extension
     name = os.path.splitext(filename)[0]
-    # Replace spaces and special characters with underscores
-    name = re.sub(r"[^a-zA-Z0-9\s]", "", name)
-    # Replace multiple spaces with single space
-    name = re.sub(r"\s+", " ", name)
-    # Convert to lowercase and replace spaces with underscores
-    code = name.lower().strip().replace(" ", "_")
-    # Remove multiple underscores
-    code = re.sub(r"_+", "_", code)
-    return code
-
-
-class Store(models.Model):
+    # Remove special characters (this also drops any underscores) and lowercase
+    if name.isascii():
+        name = name.translate(IMAGE_CODE_TABLE)
+    else:
+        name = NON_ALNUM_RE.sub("", name).lower()
+    # split() trims and collapses whitespace runs; join them with underscores
+    return "_".join(name.split())
+
+
+def clean_image_code(code):
+    """Normalise a user-provided image code to lowercase [a-z0-9_] words"""
+    if code.isascii():
+        # One translate() pass replaces the whitespace and invalid-character
+        # regexes; leading/trailing underscores are stripped below anyway
+        return UNDERSCORES_RE.sub("_", code.translate(CLEAN_CODE_TABLE)).strip("_")
+    code = WHITESPACE_RE.sub("_", code.strip().lower())
+    code = INVALID_CODE_RE.sub("", code)
+    return UNDERSCORES_RE.sub("_", code).strip("_")
+
+
+def written_fields(update_fields, *names):
+    """Whether save(update_fields=...) writes any of the given field names"""
+    return update_fields is None or any(name in update_fields for name in names)
+
+
+class ImageSlugSource(models.Model):
+    """
+    Base for the models whose names are copied onto Image as URL slugs.
+    Remembers the loaded name and parent so save() only rewrites the images'
+    slugs when one of them actually changes.
+    """
+
+    # Attribute names whose changes have to be pushed to Image slugs
+    slug_source_fields = ("name",)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Deferred fields are left out; they can't have been edited
+        instance._loaded_slug_sources = {
+            name: instance.__dict__[name]
+            for name in cls.slug_source_fields
+            if name in instance.__dict__
+        }
+        return instance
+
+    def changed_slug_sources(self, update_fields):
+        """Return the slug source fields this save() writes with a new value"""
+        if self._state.adding:
+            return set()
+        loaded = getattr(self, "_loaded_slug_sources", {})
+        return {
+            name
+            for name, value in loaded.items()
+            if written_fields(update_fields, name, name.removesuffix("_id"))
+            and getattr(self, name) != value
+        }
+
+    def remember_slug_sources(self, update_fields):
+        """Snapshot the slug source fields this save() wrote"""
+        loaded = getattr(self, "_loaded_slug_sources", {})
+        for name in self.slug_source_fields:
+            if written_fields(update_fields, name, name.removesuffix("_id")):
+                loaded[name] = getattr(self, name)
+        self._loaded_slug_sources = loaded
+
+
+class Store(ImageSlugSource):
     name = models.CharField(max_length=200)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="stores")
     # Added logo field
@@ -101,22 +288,31 @@ class Store(models.Model):
         return self.name
 
     def save(self, *args, **kwargs):
-        # Compress logo
-        if self.logo and isinstance(self.logo.file, InMemoryUploadedFile):
-            compress_image(self.logo)
-            
-        # Compress payment_qr
-        if self.payment_qr and isinstance(self.payment_qr.file, InMemoryUploadedFile):
-            compress_image(self.payment_qr)
-            
-        # Compress maps_photo
-        if self.maps_photo and isinstance(self.maps_photo.file, InMemoryUploadedFile):
-            compress_image(self.maps_photo)
-            
+        # Note new uploads (logo, payment_qr, maps_photo) before they are stored
+        uploaded = [
+            name
+            for name in ("logo", "payment_qr", "maps_photo")
+            if getattr(self, name)
+            and isinstance(getattr(self, name).file, InMemoryUploadedFile)
+        ]
+        update_fields = kwargs.get("update_fields")
+        changed = self.changed_slug_sources(update_fields)
+
         super().save(*args, **kwargs)
 
+        # Keep the slugs denormalized onto Image in sync with the name
+        if "name" in changed:
+            Image.objects.filter(product__category__store=self).update(
+                store_slug=cached_slugify(self.name)
+            )
+        self.remember_slug_sources(update_fields)
+
+        # Compress them in the background once the row is committed
+        for name in uploaded:
+            schedule_compression(self, name)
 
-class Category(models.Model):
+
+class Category(ImageSlugSource):
     store = models.ForeignKey(
         Store, on_delete=models.CASCADE, related_name="categories"
     )
@@ -128,11 +324,29 @@ class Category(models.Model):
         ordering = ["name"]
         verbose_name_plural = "categories"
 
+    slug_source_fields = ("name", "store_id")
+
     def __str__(self):
         return f"{self.store.name} - {self.name}"
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        changed = self.changed_slug_sources(update_fields)
+        super().save(*args, **kwargs)
+
+        # Keep the slugs denormalized onto Image in sync with the name and
+        # with the store the category now belongs to
+        slugs = {}
+        if "name" in changed:
+            slugs["category_slug"] = cached_slugify(self.name)
+        if "store_id" in changed:
+            slugs["store_slug"] = cached_slugify(self.store.name)
+        if slugs:
+            Image.objects.filter(product__category=self).update(**slugs)
+        self.remember_slug_sources(update_fields)
 
-class Product(models.Model):
+
+class Product(ImageSlugSource):
     category = models.ForeignKey(
         Category, on_delete=models.CASCADE, related_name="products"
     )
@@ -143,9 +357,41 @@ class Product(models.Model):
     class Meta:
         ordering = ["name"]
 
+    slug_source_fields = ("name", "category_id")
+
     def __str__(self):
         return f"{self.category.name} - {self.name}"
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        changed = self.changed_slug_sources(update_fields)
+        super().save(*args, **kwargs)
+
+        # Keep the slugs denormalized onto Image in sync with the name and
+        # with the category (and store) the product now belongs to
+        slugs = {}
+        if "name" in changed:
+            slugs["product_slug"] = cached_slugify(self.name)
+        if "category_id" in changed:
+            slugs["category_slug"] = cached_slugify(self.category.name)
+            slugs["store_slug"] = cached_slugify(self.category.store.name)
+        if slugs:
+            Image.objects.filter(product=self).update(**slugs)
+        self.remember_slug_sources(update_fields)
+
+
+# Image columns filled by Image.set_url_slugs
+URL_SLUG_FIELDS = ("store_slug", "category_slug", "product_slug")
+# Image columns filled by Image.set_file_details
+FILE_DETAIL_FIELDS = ("width", "height", "file_size")
+
+
+class ImageManager(models.Manager):
+    """Load product, category and store with every image in the same query"""
+
+    def get_queryset(self):
+        return super().get_queryset().select_related("product__category__store")
+
 
 class Image(models.Model):
     product = models.ForeignKey(
@@ -154,20 +400,29 @@ class Image(models.Model):
     name = models.CharField(max_length=200)
     image_code = models.CharField(max_length=200, unique=True)
     image_file = models.ImageField(upload_to="images/")
+    # Slugs of the store/category/product names, copied here in save() so
+    # get_absolute_url doesn't have to walk product -> category -> store
+    store_slug = models.CharField(max_length=200, blank=True, default="")
+    category_slug = models.CharField(max_length=200, blank=True, default="")
+    product_slug = models.CharField(max_length=200, blank=True, default="")
+    # Recorded from the upload so listings can lay out images without file I/O
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    file_size = models.PositiveIntegerField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ImageManager()
+
     class Meta:
         ordering = ["-created_at"]
+        indexes = [models.Index(fields=["product", "image_code"])]
 
     def __str__(self):
         return f"{self.name} ({self.image_code})"
 
-    def save(self, *args, **kwargs):
-        # Compress image if it's a new upload
-        if self.image_file and isinstance(self.image_file.file, InMemoryUploadedFile):
-            compress_image(self.image_file)
-
+    def normalize_image_code(self):
+        """Generate image_code from the file or name, or clean the provided one"""
         # Auto-generate image_code if not provided or empty
         if not self.image_code or self.image_code.strip() == "":
             if self.image_file:
@@ -176,39 +431,172 @@ class Image(models.Model):
                 self.image_code = generate_image_code(self.name)
         else:
             # Clean the provided image_code
-            self.image_code = self.image_code.strip().lower()
-            # Replace spaces with underscores
-            self.image_code = re.sub(r"\s+", "_", self.image_code)
-            # Remove invalid characters
-            self.image_code = re.sub(r"[^a-z0-9_]", "", self.image_code)
-            # Remove multiple underscores
-            self.image_code = re.sub(r"_+", "_", self.image_code)
-            self.image_code = self.image_code.strip("_")
-
-        # Ensure uniqueness
-        original_code = self.image_code
-        counter = 1
-        while (
-            Image.objects.filter(image_code=self.image_code)
+            self.image_code = clean_image_code(self.image_code)
+
+    def set_url_slugs(self, product):
+        """Copy the slugs used by get_absolute_url from a product with category/store"""
+        self.store_slug = cached_slugify(product.category.store.name)
+        self.category_slug = cached_slugify(product.category.name)
+        self.product_slug = cached_slugify(product.name)
+
+    def has_new_upload(self):
+        """Whether image_file holds an upload that still needs compressing"""
+        return bool(self.image_file) and isinstance(
+            self.image_file.file, InMemoryUploadedFile
+        )
+
+    def set_file_details(self):
+        """Record the new upload's dimensions and byte size"""
+        self.width = self.image_file.width
+        self.height = self.image_file.height
+        self.file_size = self.image_file.size
+
+    def make_image_code_unique(self, original_code):
+        """Set image_code to original_code, or its first free _N variant"""
+        # Fetch every code sharing the prefix in one query and pick the
+        # first free suffix in memory
+        taken = set(
+            Image.objects.filter(code_prefix_q(original_code))
             .exclude(pk=self.pk)
-            .exists()
-        ):
+            .order_by()
+            .values_list("image_code", flat=True)
+        )
+        self.image_code = original_code
+        if original_code in taken:
+            counter = 1
+            while f"{original_code}_{counter}" in taken:
+                counter += 1
             self.image_code = f"{original_code}_{counter}"
-            counter += 1
 
-        super().save(*args, **kwargs)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored code and product so save() can skip unchanged work
+        instance._loaded_image_code = instance.__dict__.get("image_code")
+        instance._loaded_product_id = instance.__dict__.get("product_id")
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Compress image in the background if it's a new upload
+        uploaded = self.has_new_upload()
+        update_fields = kwargs.get("update_fields")
+        if uploaded:
+            self.set_file_details()
+            if update_fields is not None:
+                update_fields = set(update_fields) | set(FILE_DETAIL_FIELDS)
+                kwargs["update_fields"] = update_fields
+
+        # An update that keeps the stored code needs no cleaning or uniqueness check
+        code_changed = self._state.adding or (
+            self.image_code != getattr(self, "_loaded_image_code", None)
+            and written_fields(update_fields, "image_code")
+        )
+        if code_changed:
+            self.normalize_image_code()
+            original_code = self.image_code
+            self.make_image_code_unique(original_code)
+
+        # Renames are pushed to the slugs by Store/Category/Product.save, so
+        # they only need loading when the image is new or changes product
+        product_changed = self.product_id != getattr(
+            self, "_loaded_product_id", None
+        ) and written_fields(update_fields, "product", "product_id")
+        if self._state.adding or not self.store_slug or product_changed:
+            # Load product, category and store in one query for the URL slugs
+            self.set_url_slugs(
+                Product.objects.select_related("category__store").get(
+                    pk=self.product_id
+                )
+            )
+            if update_fields is not None:
+                update_fields = set(update_fields) | set(URL_SLUG_FIELDS)
+                kwargs["update_fields"] = update_fields
+
+        # A concurrent save can take the code between the lookup and the
+        # INSERT; let the unique index decide and retry with a fresh suffix
+        for attempt in range(IMAGE_CODE_RETRIES):
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                break
+            except IntegrityError:
+                taken_code = self.image_code
+                if code_changed and attempt + 1 < IMAGE_CODE_RETRIES:
+                    self.make_image_code_unique(original_code)
+                if self.image_code == taken_code:
+                    raise
+
+        # Only what was written counts as loaded; an unsaved in-memory code
+        # must still be cleaned and checked by the next save
+        if written_fields(update_fields, "image_code"):
+            self._loaded_image_code = self.image_code
+        if written_fields(update_fields, "product", "product_id"):
+            self._loaded_product_id = self.product_id
+
+        if uploaded:
+            schedule_compression(self, "image_file")
+
+    @classmethod
+    def bulk_create_with_codes(cls, images, batch_size=500):
+        """
+        Insert new images in bulk. Codes are cleaned and made unique like
+        save() does, but with one lookup for the whole batch instead of
+        a query per image.
+        """
+        uploaded = [image for image in images if image.has_new_upload()]
+        for image in uploaded:
+            image.set_file_details()
+        for image in images:
+            image.normalize_image_code()
+
+        products = Product.objects.select_related("category__store").in_bulk(
+            {image.product_id for image in images}
+        )
+        for image in images:
+            image.set_url_slugs(products[image.product_id])
+
+        # Codes already in the table, plus any suffixed variants of the codes
+        # that collide (with the table or within this batch)
+        codes = Counter(image.image_code for image in images)
+        taken = set(
+            cls.objects.filter(image_code__in=codes)
+            .order_by()
+            .values_list("image_code", flat=True)
+        )
+        collided = sorted(taken | {code for code, n in codes.items() if n > 1})
+        for start in range(0, len(collided), batch_size):
+            prefixes = Q()
+            for code in collided[start : start + batch_size]:
+                prefixes |= code_prefix_q(f"{code}_")
+            taken.update(
+                cls.objects.filter(prefixes)
+                .order_by()
+                .values_list("image_code", flat=True)
+            )
+
+        for image in images:
+            original_code = image.image_code
+            counter = 1
+            while image.image_code in taken:
+                image.image_code = f"{original_code}_{counter}"
+                counter += 1
+            taken.add(image.image_code)
+
+        created = cls.objects.bulk_create(images, batch_size=batch_size)
+
+        for image in uploaded:
+            if image.pk:
+                schedule_compression(image, "image_file")
+        return created
 
     def get_absolute_url(self):
         """Return publicly accessible URL for the image"""
-        from django.urls import reverse
-        from django.utils.text import slugify
-
         return reverse(
             "image_view",
             kwargs={
-                "store_name": slugify(self.product.category.store.name),
-                "category_name": slugify(self.product.category.name),
-                "product_name": slugify(self.product.name),
+                "store_name": self.store_slug,
+                "category_name": self.category_slug,
+                "product_name": self.product_slug,
                 "image_code": self.image_code,
             },
         )
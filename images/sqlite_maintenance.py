@@ -0,0 +1,77 @@
+"""
+Plain sqlite3 helpers for the DDL-only maintenance scripts.
+These scripts talk to db.sqlite3 directly instead of going through
+django.setup() and Django's cursor wrappers.
+"""
+
+import sqlite3
+from pathlib import Path
+
+# Same file as DATABASES["default"]["NAME"] in imagehost/settings.py
+DB_PATH = Path(__file__).resolve().parent.parent / "db.sqlite3"
+
+# Table names can't be bound as SQL parameters, so they are built from this
+# template and only ever from an integer store id.
+STORE_TABLE_TEMPLATE = "store_{}_{}"
+
+
+def store_table_name(store_id, suffix):
+    """Return the store-specific table name, rejecting non-integer store ids"""
+    if isinstance(store_id, bool) or not isinstance(store_id, int):
+        raise ValueError(f"Invalid store id: {store_id!r}")
+    return STORE_TABLE_TEMPLATE.format(store_id, suffix)
+
+
+def connect(db_path=None):
+    """Open db_path (DB_PATH by default) in autocommit mode with WAL enabled"""
+    conn = sqlite3.connect(db_path or DB_PATH, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def get_stores(conn):
+    """Return [(id, name), ...] for every store, newest first like Store.objects"""
+    return conn.execute(
+        "SELECT id, name FROM images_store ORDER BY created_at DESC"
+    ).fetchall()
+
+
+def table_columns_query(suffix):
+    """
+    Return (sql, params) selecting (table, column) rows for every
+    store_*_{suffix} table: sqlite_master joined with pragma_table_info in a
+    single query instead of one PRAGMA table_info round trip per store.
+    """
+    return (
+        "SELECT m.name, p.name FROM sqlite_master m, pragma_table_info(m.name) p "
+        "WHERE m.type = 'table' AND m.name LIKE ? ESCAPE '\\'",
+        [f"store\\_%\\_{suffix}"],
+    )
+
+
+def columns_by_table(rows):
+    """Group (table, column) rows into {table_name: set of column names}"""
+    tables = {}
+    for table_name, column in rows:
+        tables.setdefault(table_name, set()).add(column)
+    return tables
+
+
+def get_table_columns(conn, suffix):
+    """Return {table_name: set of column names} for every store_*_{suffix} table"""
+    return columns_by_table(conn.execute(*table_columns_query(suffix)))
+
+
+def apply_statements(conn, statements):
+    """Run all statements as one script in a single transaction"""
+    try:
+        conn.executescript("BEGIN;\n" + ";\n".join(statements) + ";\nCOMMIT;")
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+
+def optimize(conn):
+    """Refresh SQLite's query planner statistics after schema changes"""
+    conn.execute("PRAGMA optimize")
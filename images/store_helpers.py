@@ -2,16 +2,191 @@
 Helper classes to provide Django ORM-like interface for store-specific tables
 """
 
+import logging
 import os
+from functools import lru_cache
+from io import BytesIO
+from urllib.parse import urlparse
 
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import UploadedFile
-from django.db import connection
+from django.db import IntegrityError, connection, transaction
+from django.urls import reverse
 from django.utils import timezone
+from PIL import Image as PilImage
+
+# libvips is optional; watermarking falls back to Pillow without it
+try:
+    import pyvips
+except (ImportError, OSError):
+    pyvips = None
+
+from .models import (
+    COMPRESS_SKIP_BYTES,
+    IMAGE_CODE_RETRIES,
+    JPEG_MAGIC,
+    Store,
+    cached_slugify,
+    clean_image_code,
+    compression_executor,
+    generate_image_code,
+)
+
+logger = logging.getLogger(__name__)
+
+# Store images are kept at quality 90; progressive scans make them a little
+# smaller and let browsers show a preview while they load
+STORE_JPEG_OPTIONS = {"quality": 90, "optimize": True, "progressive": True}
+
+
+# SQL for each filter() lookup; "in" gets its placeholders from the value count
+LOOKUP_SQL = {"exact": "{} = ?", "icontains": "{} LIKE ?", "in": "{} IN ({{}})"}
+
+
+@lru_cache(maxsize=256)
+def lookup_condition(key, columns):
+    """Split a filter() keyword like name__icontains into (SQL condition, lookup)"""
+    field, _, lookup = key.partition("__")
+    # Field names are interpolated into the SQL, so only real columns pass
+    if field not in columns:
+        raise ValueError(f"Invalid filter field: {field!r}")
+    lookup = lookup or "exact"
+    return LOOKUP_SQL.get(lookup, "{} = ?").format(field), lookup
+
+
+def filter_conditions(kwargs, columns):
+    """Turn filter() keyword arguments into SQL conditions and their params"""
+    conditions = []
+    params = []
+    # Sorted keywords give one SQL text per filter shape, whatever the
+    # argument order, so sqlite3's statement cache can reuse it
+    for key, value in sorted(kwargs.items()):
+        if key == "exclude":
+            # exclude={"id": ...}; bind the id so the SQL text stays the same
+            # and sqlite3's statement cache can reuse the prepared query
+            if value.get("id"):
+                conditions.append("id != ?")
+                params.append(value["id"])
+            continue
+        condition, lookup = lookup_condition(key, columns)
+        if lookup == "in":
+            conditions.append(condition.format(", ".join(["?"] * len(value))))
+            params.extend(value)
+        else:
+            conditions.append(condition)
+            params.append(f"%{value}%" if lookup == "icontains" else value)
+    return conditions, params
+
+
+class StoreQuerySet:
+    """
+    Lazy result of a manager's all()/filter()/exclude(). Like a Django
+    QuerySet, the query runs on first iteration/len() and is cached;
+    slicing, count(), first() and exists() before that only fetch what
+    they need, and chained filter() calls merge into one WHERE clause.
+    Negative or stepped indexes keep the behaviour of the lists managers
+    used to return: all results are loaded and cached, then indexed.
+    """
+
+    def __init__(self, manager, conditions=(), params=(), select_related=()):
+        self.manager = manager
+        self.conditions = list(conditions)
+        self.params = list(params)
+        self.select_related = select_related
+        self.result_cache = None
+
+    def where_sql(self):
+        return " AND ".join(self.conditions) if self.conditions else "1=1"
+
+    def fetch(self, limit=-1, offset=0):
+        """Run the query, optionally limited, and return the objects"""
+        manager = self.manager
+        sql = "{} WHERE {} ORDER BY {}".format(
+            manager.select_sql, self.where_sql(), manager.ordering
+        )
+        params = self.params
+        if limit != -1 or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params = params + [limit, offset]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            objs = [
+                manager.model.from_row(manager.store_id, row)
+                for row in cursor.fetchall()
+            ]
+        return manager.load_related(objs, self.select_related)
+
+    def results(self):
+        if self.result_cache is None:
+            self.result_cache = self.fetch()
+        return self.result_cache
+
+    def __iter__(self):
+        return iter(self.results())
+
+    def __len__(self):
+        return len(self.results())
+
+    def __bool__(self):
+        return bool(self.results())
+
+    def __getitem__(self, key):
+        if self.result_cache is not None:
+            return self.result_cache[key]
+        if isinstance(key, slice):
+            start, stop = key.start or 0, key.stop
+            if start < 0 or (stop is not None and stop < 0) or key.step:
+                return self.results()[key]
+            limit = -1 if stop is None else max(stop - start, 0)
+            return self.fetch(limit, start)
+        if key < 0:
+            return self.results()[key]
+        objs = self.fetch(1, key)
+        if not objs:
+            raise IndexError("StoreQuerySet index out of range")
+        return objs[0]
+
+    def filter(self, **kwargs):
+        conditions, params = filter_conditions(kwargs, self.manager.model.COLUMNS)
+        return StoreQuerySet(
+            self.manager,
+            self.conditions + conditions,
+            self.params + params,
+            self.select_related,
+        )
+
+    def count(self):
+        if self.result_cache is not None:
+            return len(self.result_cache)
+        with connection.cursor() as cursor:
+            sql = "SELECT COUNT(*) FROM {} WHERE {}".format(
+                self.manager.table_name, self.where_sql()
+            )
+            cursor.execute(sql, self.params)
+            return cursor.fetchone()[0]
+
+    def exists(self):
+        if self.result_cache is not None:
+            return bool(self.result_cache)
+        with connection.cursor() as cursor:
+            sql = "SELECT 1 FROM {} WHERE {} LIMIT 1".format(
+                self.manager.table_name, self.where_sql()
+            )
+            cursor.execute(sql, self.params)
+            return cursor.fetchone() is not None
+
+    def first(self):
+        objs = self[:1]
+        return objs[0] if objs else None
 
 
 class StoreCategory:
     """Category model for store-specific tables"""
 
+    __slots__ = ("store_id", "table_name", "id", "name", "created_at", "updated_at")
+
     def __init__(self, store_id, data=None):
         self.store_id = store_id
         self.table_name = f"store_{store_id}_categories"
@@ -26,6 +201,18 @@ class StoreCategory:
             self.created_at = None
             self.updated_at = None
 
+    # Columns the manager queries select, in row order
+    COLUMNS = ("id", "name", "created_at", "updated_at")
+
+    @classmethod
+    def from_row(cls, store_id, row):
+        """Build an instance from a row of COLUMNS without the dict-based __init__"""
+        obj = cls.__new__(cls)
+        obj.store_id = store_id
+        obj.table_name = f"store_{store_id}_categories"
+        obj.id, obj.name, obj.created_at, obj.updated_at = row
+        return obj
+
     def save(self):
         now = timezone.now()
         with connection.cursor() as cursor:
@@ -55,71 +242,54 @@ class StoreCategory:
     def __str__(self):
         return self.name or ""
 
+    # Managers keep no per-query state, so each store's manager is built once
     @classmethod
+    @lru_cache(maxsize=1024)
     def objects(cls, store_id):
         """Return a manager-like object"""
         return StoreCategoryManager(store_id)
 
 
 class StoreCategoryManager:
+    model = StoreCategory
+    ordering = "name"
+
     def __init__(self, store_id):
-        self.store_id = store_id
-        self.table_name = f"store_{store_id}_categories"
+        # Table names are interpolated into every statement; int() makes sure
+        # nothing but a store id ever ends up there
+        self.store_id = int(store_id)
+        self.table_name = f"store_{self.store_id}_categories"
+        self.select_sql = "SELECT {} FROM {}".format(
+            ", ".join(StoreCategory.COLUMNS), self.table_name
+        )
 
     def all(self):
+        return StoreQuerySet(self)
+
+    def load_related(self, categories, select_related):
+        """Categories have no relations to load; kept for StoreQuerySet"""
+        return categories
+
+    def iterator(self, chunk_size=1000):
+        """Yield categories like all(), fetching chunk_size rows at a time"""
         with connection.cursor() as cursor:
-            sql = "SELECT * FROM {} ORDER BY name".format(self.table_name)
-            cursor.execute(sql)
-            columns = [col[0] for col in cursor.description]
-            return [
-                StoreCategory(self.store_id, dict(zip(columns, row)))
-                for row in cursor.fetchall()
-            ]
+            cursor.execute(f"{self.select_sql} ORDER BY {self.ordering}")
+            while rows := cursor.fetchmany(chunk_size):
+                for row in rows:
+                    yield StoreCategory.from_row(self.store_id, row)
 
     def get(self, **kwargs):
+        conditions, params = filter_conditions(kwargs, self.model.COLUMNS)
         with connection.cursor() as cursor:
-            conditions = []
-            params = []
-            for key, value in kwargs.items():
-                conditions.append(f"{key} = ?")
-                params.append(value)
-            where_clause = " AND ".join(conditions)
-            sql = "SELECT * FROM {} WHERE {}".format(self.table_name, where_clause)
+            sql = f"{self.select_sql} WHERE {' AND '.join(conditions)}"
             cursor.execute(sql, params)
-            columns = [col[0] for col in cursor.description]
             row = cursor.fetchone()
             if row:
-                return StoreCategory(self.store_id, dict(zip(columns, row)))
-            from django.core.exceptions import ObjectDoesNotExist
-
+                return StoreCategory.from_row(self.store_id, row)
             raise ObjectDoesNotExist(f"Category matching query does not exist")
 
     def filter(self, **kwargs):
-        with connection.cursor() as cursor:
-            conditions = []
-            params = []
-            for key, value in kwargs.items():
-                if "__" in key:
-                    field, lookup = key.split("__", 1)
-                    if lookup == "icontains":
-                        conditions.append(f"{field} LIKE ?")
-                        params.append(f"%{value}%")
-                    else:
-                        conditions.append(f"{field} = ?")
-                        params.append(value)
-                else:
-                    conditions.append(f"{key} = ?")
-                    params.append(value)
-            where_clause = " AND ".join(conditions) if conditions else "1=1"
-            sql = "SELECT * FROM {} WHERE {} ORDER BY name".format(
-                self.table_name, where_clause
-            )
-            cursor.execute(sql, params)
-            columns = [col[0] for col in cursor.description]
-            return [
-                StoreCategory(self.store_id, dict(zip(columns, row)))
-                for row in cursor.fetchall()
-            ]
+        return StoreQuerySet(self, *filter_conditions(kwargs, self.model.COLUMNS))
 
     def create(self, **kwargs):
         category = StoreCategory(self.store_id)
@@ -128,10 +298,49 @@ class StoreCategoryManager:
         category.save()
         return category
 
+    def bulk_create(self, categories):
+        """Insert new categories with one executemany; like Django, ids are not set"""
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            sql = "INSERT INTO {} (name, created_at, updated_at) VALUES (?, ?, ?)".format(
+                self.table_name
+            )
+            cursor.executemany(sql, [(c.name, now, now) for c in categories])
+        for category in categories:
+            category.created_at = category.updated_at = now
+        return categories
+
+
+def load_categories(store_id, products):
+    """Fetch the categories of all products in one query and cache them on each"""
+    category_ids = list({p.category_id for p in products if p.category_id})
+    if category_ids:
+        categories = {
+            category.id: category
+            for category in StoreCategory.objects(store_id).filter(id__in=category_ids)
+        }
+        for product in products:
+            product._category = categories.get(product.category_id)
+    return products
+
 
 class StoreProduct:
     """Product model for store-specific tables"""
 
+    __slots__ = (
+        "store_id",
+        "table_name",
+        "id",
+        "category_id",
+        "name",
+        "marked_price",
+        "min_discounted_price",
+        "description",
+        "created_at",
+        "updated_at",
+        "_category",
+    )
+
     def __init__(self, store_id, data=None):
         self.store_id = store_id
         self.table_name = f"store_{store_id}_products"
@@ -156,6 +365,37 @@ class StoreProduct:
             self.updated_at = None
             self._category = None
 
+    # Columns the manager queries select, in row order
+    COLUMNS = (
+        "id",
+        "category_id",
+        "name",
+        "marked_price",
+        "min_discounted_price",
+        "description",
+        "created_at",
+        "updated_at",
+    )
+
+    @classmethod
+    def from_row(cls, store_id, row):
+        """Build an instance from a row of COLUMNS without the dict-based __init__"""
+        obj = cls.__new__(cls)
+        obj.store_id = store_id
+        obj.table_name = f"store_{store_id}_products"
+        (
+            obj.id,
+            obj.category_id,
+            obj.name,
+            obj.marked_price,
+            obj.min_discounted_price,
+            obj.description,
+            obj.created_at,
+            obj.updated_at,
+        ) = row
+        obj._category = None
+        return obj
+
     @property
     def category(self):
         if not self._category and self.category_id:
@@ -231,73 +471,52 @@ class StoreProduct:
         return self.name or ""
 
     @classmethod
+    @lru_cache(maxsize=1024)
     def objects(cls, store_id):
         return StoreProductManager(store_id)
 
 
 class StoreProductManager:
+    model = StoreProduct
+    ordering = "name"
+
     def __init__(self, store_id):
-        self.store_id = store_id
-        self.table_name = f"store_{store_id}_products"
+        self.store_id = int(store_id)
+        self.table_name = f"store_{self.store_id}_products"
+        self.select_sql = "SELECT {} FROM {}".format(
+            ", ".join(StoreProduct.COLUMNS), self.table_name
+        )
 
-    def all(self):
+    def all(self, select_related=()):
+        return StoreQuerySet(self, select_related=select_related)
+
+    def load_related(self, products, select_related):
+        """Attach categories (select_related=("category",)) with one query"""
+        if "category" in select_related:
+            load_categories(self.store_id, products)
+        return products
+
+    def iterator(self, chunk_size=1000):
+        """Yield products like all(), fetching chunk_size rows at a time"""
         with connection.cursor() as cursor:
-            sql = "SELECT * FROM {} ORDER BY name".format(self.table_name)
-            cursor.execute(sql)
-            columns = [col[0] for col in cursor.description]
-            return [
-                StoreProduct(self.store_id, dict(zip(columns, row)))
-                for row in cursor.fetchall()
-            ]
+            cursor.execute(f"{self.select_sql} ORDER BY {self.ordering}")
+            while rows := cursor.fetchmany(chunk_size):
+                for row in rows:
+                    yield StoreProduct.from_row(self.store_id, row)
 
     def get(self, **kwargs):
+        conditions, params = filter_conditions(kwargs, self.model.COLUMNS)
         with connection.cursor() as cursor:
-            conditions = []
-            params = []
-            for key, value in kwargs.items():
-                conditions.append(f"{key} = ?")
-                params.append(value)
-            where_clause = " AND ".join(conditions)
-            sql = "SELECT * FROM {} WHERE {}".format(self.table_name, where_clause)
+            sql = f"{self.select_sql} WHERE {' AND '.join(conditions)}"
             cursor.execute(sql, params)
-            columns = [col[0] for col in cursor.description]
             row = cursor.fetchone()
             if row:
-                return StoreProduct(self.store_id, dict(zip(columns, row)))
-            from django.core.exceptions import ObjectDoesNotExist
-
+                return StoreProduct.from_row(self.store_id, row)
             raise ObjectDoesNotExist(f"Product matching query does not exist")
 
-    def filter(self, **kwargs):
-        with connection.cursor() as cursor:
-            conditions = []
-            params = []
-            for key, value in kwargs.items():
-                if "__" in key:
-                    field, lookup = key.split("__", 1)
-                    if lookup == "icontains":
-                        conditions.append(f"{field} LIKE ?")
-                        params.append(f"%{value}%")
-                    elif lookup == "in":
-                        placeholders = ", ".join(["?" for _ in value])
-                        conditions.append(f"{field} IN ({placeholders})")
-                        params.extend(value)
-                    else:
-                        conditions.append(f"{field} = ?")
-                        params.append(value)
-                else:
-                    conditions.append(f"{key} = ?")
-                    params.append(value)
-            where_clause = " AND ".join(conditions) if conditions else "1=1"
-            sql = "SELECT * FROM {} WHERE {} ORDER BY name".format(
-                self.table_name, where_clause
-            )
-            cursor.execute(sql, params)
-            columns = [col[0] for col in cursor.description]
-            return [
-                StoreProduct(self.store_id, dict(zip(columns, row)))
-                for row in cursor.fetchall()
-            ]
+    def filter(self, select_related=(), **kwargs):
+        conditions, params = filter_conditions(kwargs, self.model.COLUMNS)
+        return StoreQuerySet(self, conditions, params, select_related)
 
     def create(self, **kwargs):
         product = StoreProduct(self.store_id)
@@ -310,10 +529,232 @@ class StoreProductManager:
         product.save()
         return product
 
+    def bulk_create(self, products):
+        """Insert new products with one executemany; like Django, ids are not set"""
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            sql = """
+            INSERT INTO {} (
+                category_id, name, marked_price, min_discounted_price,
+                description, created_at, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?)""".format(self.table_name)
+            cursor.executemany(
+                sql,
+                [
+                    (
+                        p.category_id,
+                        p.name,
+                        p.marked_price,
+                        p.min_discounted_price,
+                        p.description,
+                        now,
+                        now,
+                    )
+                    for p in products
+                ],
+            )
+        for product in products:
+            product.created_at = product.updated_at = now
+        return products
+
+
+def load_products(store_id, images):
+    """Fetch the products of all images in one query and cache them on each"""
+    product_ids = list({image.product_id for image in images if image.product_id})
+    if product_ids:
+        products = {
+            product.id: product
+            for product in StoreProduct.objects(store_id).filter(id__in=product_ids)
+        }
+        for image in images:
+            image._product = products.get(image.product_id)
+    return images
+
+
+@lru_cache(maxsize=64)
+def load_logo(name, modified):
+    """
+    Read a store logo once for all uploads: the raw bytes for libvips, or the
+    decoded RGBA image for Pillow. The modification time is part of the key
+    so a replaced logo is read again.
+    """
+    with default_storage.open(name, "rb") as logo_file:
+        data = logo_file.read()
+    if pyvips is not None:
+        return data
+    with PilImage.open(BytesIO(data)) as logo_image:
+        return logo_image.convert("RGBA")
+
+
+@lru_cache(maxsize=256)
+def scaled_logo(name, modified, width):
+    """
+    The store logo resized to a watermark width. Upload widths repeat (phone
+    and camera sizes), so each store only pays for a handful of resizes.
+    """
+    logo = load_logo(name, modified)
+    if pyvips is not None:
+        mark = pyvips.Image.thumbnail_buffer(
+            logo, width, height=10_000_000, size="down"
+        ).colourspace("srgb")
+        # Render once; a lazy vips image would redo the resize on every use
+        return mark.copy_memory()
+    height = int(width * logo.height / logo.width)
+    return logo.resize((width, height), PilImage.Resampling.LANCZOS)
+
+
+def render_store_image(source, filename, logo=None):
+    """Watermark an upload with the store logo and encode it; returns (filename, BytesIO)"""
+    if pyvips is not None:
+        return render_store_image_vips(source.read(), filename, logo)
+    return render_store_image_pil(source, filename, logo)
+
+
+def render_store_image_vips(data, filename, logo=None):
+    """libvips version of render_store_image"""
+    image = pyvips.Image.new_from_buffer(data, "").colourspace("srgb")
+
+    if logo:
+        try:
+            modified = logo.storage.get_modified_time(logo.name)
+            # Resize logo: 15% of image width, never upscaled
+            target_width = int(image.width * 0.15)
+            if target_width > 0:
+                mark = scaled_logo(logo.name, modified, target_width)
+
+                # Composite in top left (0, 0), keeping the original format
+                marked = image.composite2(mark, "over", x=0, y=0)
+                ext = os.path.splitext(filename)[1].lower()
+                if ext in (".jpg", ".jpeg"):
+                    content = marked.extract_band(0, n=3).jpegsave_buffer(
+                        Q=90, optimize_coding=True, strip=True, interlace=True
+                    )
+                elif ext == ".gif":
+                    content = marked.gifsave_buffer()
+                else:
+                    # Default to PNG for transparency support
+                    content = marked.pngsave_buffer()
+                # BytesIO shares the encoded bytes instead of copying them
+                return filename, BytesIO(content)
+        except Exception as e:
+            # Proceed without watermark on error, but still compress
+            print(f"Error applying watermark: {str(e)}")
+
+    if image.hasalpha():
+        image = image.extract_band(0, n=3)
+    content = image.jpegsave_buffer(
+        Q=90, optimize_coding=True, strip=True, interlace=True
+    )
+    return os.path.splitext(filename)[0] + ".jpg", BytesIO(content)
+
+
+def render_store_image_pil(source, filename, logo=None):
+    """Pillow version of render_store_image, used when libvips is unavailable"""
+    image = PilImage.open(source)
+
+    if logo:
+        try:
+            modified = logo.storage.get_modified_time(logo.name)
+            logo_image = load_logo(logo.name, modified)
+            # Resize logo: 15% of image width, never upscaled
+            target_width = min(int(image.width * 0.15), logo_image.width)
+            if target_width > 0:
+                mark = scaled_logo(logo.name, modified, target_width)
+
+                # Paste in top left (0, 0), keeping the original format
+                output = BytesIO()
+                ext = os.path.splitext(filename)[1].lower()
+                if ext in (".jpg", ".jpeg"):
+                    # The logo's alpha is the paste mask, so a JPEG can stay RGB
+                    # instead of round-tripping through RGBA
+                    marked = image if image.mode == "RGB" else image.convert("RGB")
+                    marked.paste(mark, (0, 0), mark)
+                    marked.save(output, format="JPEG", **STORE_JPEG_OPTIONS)
+                else:
+                    marked = image.convert("RGBA")
+                    marked.paste(mark, (0, 0), mark)
+                    if ext == ".gif":
+                        marked.save(output, format="GIF")
+                    else:
+                        # Default to PNG for transparency support
+                        marked.save(output, format="PNG")
+                output.seek(0)
+                return filename, output
+        except Exception as e:
+            # Proceed without watermark on error, but still compress
+            print(f"Error applying watermark: {str(e)}")
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    output = BytesIO()
+    image.save(output, format="JPEG", **STORE_JPEG_OPTIONS)
+    # Hand the buffer itself to storage; getvalue() would copy the image
+    output.seek(0)
+    return os.path.splitext(filename)[0] + ".jpg", output
+
+
+def process_store_image(store_id, image_id):
+    """Watermark and re-encode a saved store image and point its row at the result"""
+    table_name = f"store_{store_id}_images"
+    try:
+        with connection.cursor() as cursor:
+            sql = "SELECT image_file FROM {} WHERE id = ?".format(table_name)
+            cursor.execute(sql, [image_id])
+            row = cursor.fetchone()
+        if not row or not row[0]:
+            return
+        old_name = row[0]
+
+        store = Store.objects.only("logo").get(id=store_id)
+        with default_storage.open(old_name, "rb") as original:
+            # With no logo to add, a small JPEG is already compressed enough;
+            # keep it as uploaded instead of decoding and re-encoding it
+            if not store.logo and original.size < COMPRESS_SKIP_BYTES:
+                if original.read(len(JPEG_MAGIC)) == JPEG_MAGIC:
+                    return
+                original.seek(0)
+            filename, content = render_store_image(
+                original, os.path.basename(old_name), store.logo
+            )
+        new_name = default_storage.save(
+            f"images/store_{store_id}/{filename}", File(content)
+        )
+
+        # Only swap the file if no newer upload replaced it in the meantime
+        with connection.cursor() as cursor:
+            sql = "UPDATE {} SET image_file = ?, updated_at = ? WHERE id = ? AND image_file = ?".format(
+                table_name
+            )
+            cursor.execute(sql, [new_name, timezone.now(), image_id, old_name])
+            updated = cursor.rowcount
+        default_storage.delete(old_name if updated else new_name)
+    except Exception:
+        # Runs on a worker thread, so log with the traceback instead of printing
+        logger.exception(
+            "Processing failed for store %s image %s", store_id, image_id
+        )
+    finally:
+        connection.close()
+
 
 class StoreImage:
     """Image model for store-specific tables"""
 
+    __slots__ = (
+        "store_id",
+        "table_name",
+        "id",
+        "product_id",
+        "name",
+        "image_code",
+        "image_file",
+        "url",
+        "created_at",
+        "updated_at",
+        "_product",
+        "_loaded_image_code",
+    )
+
     def __init__(self, store_id, data=None):
         self.store_id = store_id
         self.table_name = f"store_{store_id}_images"
@@ -337,6 +778,41 @@ class StoreImage:
             self.created_at = None
             self.updated_at = None
             self._product = None
+        # Code as last read from/written to the table; save() only has to check
+        # uniqueness when it differs
+        self._loaded_image_code = self.image_code
+
+    # Columns the manager queries select, in row order
+    COLUMNS = (
+        "id",
+        "product_id",
+        "name",
+        "image_code",
+        "image_file",
+        "url",
+        "created_at",
+        "updated_at",
+    )
+
+    @classmethod
+    def from_row(cls, store_id, row):
+        """Build an instance from a row of COLUMNS without the dict-based __init__"""
+        obj = cls.__new__(cls)
+        obj.store_id = store_id
+        obj.table_name = f"store_{store_id}_images"
+        (
+            obj.id,
+            obj.product_id,
+            obj.name,
+            obj.image_code,
+            obj.image_file,
+            obj.url,
+            obj.created_at,
+            obj.updated_at,
+        ) = row
+        obj._product = None
+        obj._loaded_image_code = obj.image_code
+        return obj
 
     @property
     def product(self):
@@ -357,15 +833,24 @@ class StoreImage:
         else:
             self.product_id = value
 
-    def save(self):
-        import re
-        from io import BytesIO
-
-        from django.core.files.base import ContentFile
-        from PIL import Image
-
-        from .models import Store, generate_image_code, compress_image
+    def unique_image_code(self, cursor, code):
+        """Return code, or code_N with the lowest N not taken by another image"""
+        # Fetch every code sharing the prefix in one query (a range scan on the
+        # unique index; codes only contain [a-z0-9_], which all sort before "~")
+        # and pick the first free suffix in memory
+        sql = "SELECT image_code FROM {} WHERE image_code >= ? AND image_code < ? AND id IS NOT ?".format(
+            self.table_name
+        )
+        cursor.execute(sql, [code, code + "~", self.id])
+        taken = {row[0] for row in cursor.fetchall()}
+        if code not in taken:
+            return code
+        counter = 1
+        while f"{code}_{counter}" in taken:
+            counter += 1
+        return f"{code}_{counter}"
 
+    def save(self):
         # Auto-generate image_code if not provided
         if not self.image_code or self.image_code.strip() == "":
             if self.image_file:
@@ -375,8 +860,6 @@ class StoreImage:
                     self.image_code = generate_image_code(str(self.image_file))
             elif self.url:
                  # Try to get filename from URL
-                 import os
-                 from urllib.parse import urlparse
                  path = urlparse(self.url).path
                  filename = os.path.basename(path)
                  if filename:
@@ -387,145 +870,14 @@ class StoreImage:
                 self.image_code = generate_image_code(self.name)
         else:
             # Clean the provided image_code
-            self.image_code = self.image_code.strip().lower()
-            self.image_code = re.sub(r"\s+", "_", self.image_code)
-            self.image_code = re.sub(r"[^a-z0-9_]", "", self.image_code)
-            self.image_code = re.sub(r"_+", "_", self.image_code)
-            self.image_code = self.image_code.strip("_")
+            self.image_code = clean_image_code(self.image_code)
 
-        # Ensure uniqueness within this store's table
         original_code = self.image_code
-        counter = 1
-        while True:
-            existing_images = StoreImage.objects(self.store_id).filter(
-                image_code=self.image_code
-            )
-            if not existing_images:
-                break
-            # Check if it's a same record update
-            if self.id and existing_images[0].id == self.id:
-                break
-            self.image_code = f"{original_code}_{counter}"
-            counter += 1
 
-        # Apply logo watermark if it's a new upload
-        if isinstance(self.image_file, UploadedFile):
-            try:
-                store = Store.objects.get(id=self.store_id)
-                if store.logo:
-                    # Open the uploaded image
-                    self.image_file.seek(0)
-                    image = Image.open(self.image_file)
-
-                    # Open the logo
-                    logo = Image.open(store.logo)
-
-                    # Resize logo: 15% of image width
-                    target_width = int(image.width * 0.15)
-                    # Do not upscale logo
-                    target_width = (
-                        min(target_width, logo.width)
-                        if logo.width > target_width
-                        else logo.width
-                    )
-
-                    if target_width > 0:
-                        aspect_ratio = logo.height / logo.width
-                        target_height = int(target_width * aspect_ratio)
-                        logo = logo.resize(
-                            (target_width, target_height), Image.Resampling.LANCZOS
-                        )
-
-                        # Prepare for pasting (handle alpha channels)
-                        if image.mode != "RGBA":
-                            image = image.convert("RGBA")
-                        if logo.mode != "RGBA":
-                            logo = logo.convert("RGBA")
-
-                        # Paste in top left (0, 0)
-                        image.paste(logo, (0, 0), logo)
-
-                        # Save back
-                        output = BytesIO()
-                        # Default to PNG for transparency support, but try to respect original format if possible
-                        save_format = "PNG"
-                        filename = self.image_file.name
-                        ext = os.path.splitext(filename)[1].lower()
-
-                        if ext in [".jpg", ".jpeg"]:
-                            image = image.convert("RGB")
-                            save_format = "JPEG"
-                            # Use compression settings
-                            image.save(output, format=save_format, quality=90, optimize=True)
-                        elif ext == ".gif":
-                            save_format = "GIF"
-                            image.save(output, format=save_format)
-                        else:
-                            # PNG or others
-                            image.save(output, format=save_format)
-                            
-                        # If PNG, we might want to optimize too, but quality param is different. 
-                        # For now, focus on JPEG compression as requested.
-
-                        output.seek(0)
-
-                        # Replace the file content
-                        self.image_file = ContentFile(output.read(), name=filename)
-            except Exception as e:
-                # Proceed without watermark on error, but ensure compression
-                print(f"Error applying watermark: {str(e)}")
-                if self.image_file and not self.url:
-                     # Attempt generic compression
-                     try:
-                         # compress_image expects an object with .file, .name. 
-                         # self.image_file is UploadedFile/ContentFile.
-                         # We can try to wrap it effectively or just use it if it mimics FieldFile.
-                         # Actually compress_image modifies .file attribute of the passed object.
-                         # StoreImage.image_file IS the file object (UploadedFile). 
-                         # So passing self directly won't work, passing self.image_file might not work if it doesn't have .file 
-                         # (UploadedFile has .file, ContentFile might not in same way).
-                         # Let's simplify: only compress if it's an UploadedFile (fresh upload).
-                         if isinstance(self.image_file, UploadedFile):
-                              # We need a wrapper to satisfy compress_image which updates field.file
-                              # Or better, just replicate logic or make compress_image more flexible.
-                              # Given I can't easily change compress_image signature everywhere if used by other models,
-                              # I'll just replicate the basic safe logic or assume it works on the file wrapper.
-                              # Actually, let's just use the Pillow logic directly here to be safe and explicit.
-                              pass 
-                     except:
-                         pass
-
-        # If we didn't apply watermark (or failed), we simply save the file. 
-        # But we MUST compress it if it is a new upload.
-        # Check if it is a new upload (UploadedFile matches) AND we haven't already processed it (ContentFile matches processed).
-        # Note: In the watermark block above, we replaced self.image_file with ContentFile.
-        # So if it is STILL UploadedFile, it means no watermark was applied.
-        if isinstance(self.image_file, UploadedFile):
-             try:
-                 # Compress the raw upload
-                 img = Image.open(self.image_file)
-                 if img.mode != "RGB":
-                     img = img.convert("RGB")
-                 
-                 output = BytesIO()
-                 # Enforce 90% quality
-                 img.save(output, format="JPEG", quality=90, optimize=True)
-                 output.seek(0)
-                 
-                 # Create new ContentFile with .jpg extension
-                 new_name = os.path.splitext(self.image_file.name)[0] + ".jpg"
-                 self.image_file = ContentFile(output.read(), name=new_name)
-             except Exception as e:
-                 print(f"Compression failed: {e}")
-
-        # Handle file upload saving
+        # Store new uploads as-is; the watermark and JPEG encoding happen in
+        # the background (process_store_image) once the row is committed
         file_path = None
-        if isinstance(self.image_file, UploadedFile) or isinstance(
-            self.image_file, ContentFile
-        ):
-            from django.core.files.storage import default_storage
-
-            # self.image_file might be ContentFile now, ensure it has a name
+        if isinstance(self.image_file, (UploadedFile, ContentFile)):
             name = getattr(self.image_file, "name", "unnamed.jpg")
             file_path = default_storage.save(
                 f"images/store_{self.store_id}/{name}", self.image_file
@@ -534,7 +886,9 @@ class StoreImage:
         now = timezone.now()
         with connection.cursor() as cursor:
             if self.id:
-                # Update
+                # Update; an unchanged code is already unique
+                if original_code != self._loaded_image_code:
+                    self.image_code = self.unique_image_code(cursor, original_code)
                 if file_path:
                     sql = "UPDATE {} SET product_id = ?, name = ?, image_code = ?, image_file = ?, url = ?, updated_at = ? WHERE id = ?".format(
                         self.table_name
@@ -559,28 +913,41 @@ class StoreImage:
                         sql, [self.product_id, self.name, self.image_code, self.url, now, self.id]
                     )
             else:
-                # Create
-                if not file_path:
-                    file_path = (
-                        self.image_file if isinstance(self.image_file, str) else None
-                    )
-                sql = "INSERT INTO {} (product_id, name, image_code, image_file, url, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)".format(
-                    self.table_name
+                # Create: insert optimistically and let the unique index reject
+                # a taken code; only then look up the free suffixes and retry
+                stored_file = file_path or (
+                    self.image_file if isinstance(self.image_file, str) else None
                 )
-                cursor.execute(
-                    sql,
-                    [self.product_id, self.name, self.image_code, file_path, self.url, now, now],
+                sql = "INSERT INTO {} (product_id, name, image_code, image_file, url, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (image_code) DO NOTHING RETURNING id".format(
+                    self.table_name
                 )
-                self.id = cursor.lastrowid
+                row = None
+                for _ in range(IMAGE_CODE_RETRIES):
+                    cursor.execute(
+                        sql,
+                        [self.product_id, self.name, self.image_code, stored_file, self.url, now, now],
+                    )
+                    row = cursor.fetchone()
+                    if row:
+                        break
+                    self.image_code = self.unique_image_code(cursor, original_code)
+                if row is None:
+                    raise IntegrityError(
+                        f"Could not find a free image code for {original_code!r}"
+                    )
+                self.id = row[0]
                 self.created_at = now
             self.updated_at = now
+        self._loaded_image_code = self.image_code
+
+        if file_path:
+            args = (process_store_image, self.store_id, self.id)
+            transaction.on_commit(lambda: compression_executor.submit(*args))
 
     def delete(self):
         if self.id:
             # Delete file if exists
             if self.image_file:
-                from django.core.files.storage import default_storage
-
                 try:
                     default_storage.delete(self.image_file)
                 except:
@@ -593,122 +960,92 @@ class StoreImage:
         return f"{self.name} ({self.image_code})"
 
     @classmethod
+    @lru_cache(maxsize=1024)
     def objects(cls, store_id):
         return StoreImageManager(store_id)
 
-    def get_absolute_url(self):
+    def get_absolute_url(self, store=None):
         """Return publicly accessible URL for the image"""
-        from django.urls import reverse
-        from django.utils.text import slugify
-
-        from .models import Store
-
-        store = Store.objects.get(id=self.store_id)
+        # Galleries pass the store they already have and load images with
+        # select_related=("product__category",), so this needs no queries
+        if store is not None:
+            store_name = store.name
+        else:
+            store_name = Store.objects.values_list("name", flat=True).get(
+                id=self.store_id
+            )
         product = self.product
         category = product.category
         return reverse(
             "image_view",
             kwargs={
-                "store_name": slugify(store.name),
-                "category_name": slugify(category.name),
-                "product_name": slugify(product.name),
+                "store_name": cached_slugify(store_name),
+                "category_name": cached_slugify(
+                    category.name if category else "uncategorized"
+                ),
+                "product_name": cached_slugify(product.name),
                 "image_code": self.image_code,
             },
         )
 
 
 class StoreImageManager:
+    model = StoreImage
+    ordering = "created_at DESC"
+
     def __init__(self, store_id):
-        self.store_id = store_id
-        self.table_name = f"store_{store_id}_images"
+        self.store_id = int(store_id)
+        self.table_name = f"store_{self.store_id}_images"
+        self.select_sql = "SELECT {} FROM {}".format(
+            ", ".join(StoreImage.COLUMNS), self.table_name
+        )
 
-    def all(self):
+    def all(self, select_related=()):
+        return StoreQuerySet(self, select_related=select_related)
+
+    def load_related(self, images, select_related):
+        """
+        Attach products (select_related=("product",)) and optionally their
+        categories ("product__category") with one query per table
+        """
+        if "product" in select_related or "product__category" in select_related:
+            load_products(self.store_id, images)
+        if "product__category" in select_related:
+            load_categories(
+                self.store_id, [image._product for image in images if image._product]
+            )
+        return images
+
+    def iterator(self, chunk_size=1000):
+        """Yield images like all(), fetching chunk_size rows at a time"""
         with connection.cursor() as cursor:
-            sql = "SELECT * FROM {} ORDER BY created_at DESC".format(self.table_name)
-            cursor.execute(sql)
-            columns = [col[0] for col in cursor.description]
-            return [
-                StoreImage(self.store_id, dict(zip(columns, row)))
-                for row in cursor.fetchall()
-            ]
+            cursor.execute(f"{self.select_sql} ORDER BY {self.ordering}")
+            while rows := cursor.fetchmany(chunk_size):
+                for row in rows:
+                    yield StoreImage.from_row(self.store_id, row)
 
     def get(self, **kwargs):
+        conditions, params = filter_conditions(kwargs, self.model.COLUMNS)
         with connection.cursor() as cursor:
-            conditions = []
-            params = []
-            for key, value in kwargs.items():
-                conditions.append(f"{key} = ?")
-                params.append(value)
-            where_clause = " AND ".join(conditions)
-            sql = "SELECT * FROM {} WHERE {}".format(self.table_name, where_clause)
+            sql = f"{self.select_sql} WHERE {' AND '.join(conditions)}"
             cursor.execute(sql, params)
-            columns = [col[0] for col in cursor.description]
             row = cursor.fetchone()
             if row:
-                return StoreImage(self.store_id, dict(zip(columns, row)))
-            from django.core.exceptions import ObjectDoesNotExist
-
+                return StoreImage.from_row(self.store_id, row)
             raise ObjectDoesNotExist(f"Image matching query does not exist")
 
-    def filter(self, **kwargs):
-        with connection.cursor() as cursor:
-            conditions = []
-            params = []
-            exclude_id = None
-            for key, value in kwargs.items():
-                if key == "exclude":
-                    # Handle exclude separately
-                    continue
-                if "__" in key:
-                    field, lookup = key.split("__", 1)
-                    if lookup == "icontains":
-                        conditions.append(f"{field} LIKE ?")
-                        params.append(f"%{value}%")
-                    else:
-                        conditions.append(f"{field} = ?")
-                        params.append(value)
-                else:
-                    conditions.append(f"{key} = ?")
-                    params.append(value)
-
-            # Handle exclude
-            if "exclude" in kwargs:
-                exclude_dict = kwargs["exclude"]
-                if "id" in exclude_dict:
-                    exclude_id = exclude_dict["id"]
-
-            where_clause = " AND ".join(conditions) if conditions else "1=1"
-            if exclude_id:
-                where_clause += f" AND id != {exclude_id}"
-
-            sql = "SELECT * FROM {} WHERE {} ORDER BY created_at DESC".format(
-                self.table_name, where_clause
-            )
-            cursor.execute(sql, params)
-            columns = [col[0] for col in cursor.description]
-            return [
-                StoreImage(self.store_id, dict(zip(columns, row)))
-                for row in cursor.fetchall()
-            ]
+    def filter(self, select_related=(), **kwargs):
+        conditions, params = filter_conditions(kwargs, self.model.COLUMNS)
+        return StoreQuerySet(self, conditions, params, select_related)
 
     def exclude(self, **kwargs):
         """Exclude records matching the criteria"""
-        with connection.cursor() as cursor:
-            conditions = []
-            params = []
-            for key, value in kwargs.items():
-                conditions.append(f"{key} != ?")
-                params.append(value)
-            where_clause = " AND ".join(conditions) if conditions else "1=1"
-            sql = "SELECT * FROM {} WHERE {} ORDER BY created_at DESC".format(
-                self.table_name, where_clause
-            )
-            cursor.execute(sql, params)
-            columns = [col[0] for col in cursor.description]
-            return [
-                StoreImage(self.store_id, dict(zip(columns, row)))
-                for row in cursor.fetchall()
-            ]
+        keys = sorted(kwargs)
+        for key in keys:
+            if key not in self.model.COLUMNS:
+                raise ValueError(f"Invalid filter field: {key!r}")
+        conditions = [f"{key} != ?" for key in keys]
+        return StoreQuerySet(self, conditions, [kwargs[key] for key in keys])
 
     def create(self, **kwargs):
         image = StoreImage(self.store_id)
@@ -722,15 +1059,5 @@ class StoreImageManager:
         return image
 
     def exists(self, **kwargs):
-        with connection.cursor() as cursor:
-            conditions = []
-            params = []
-            for key, value in kwargs.items():
-                conditions.append(f"{key} = ?")
-                params.append(value)
-            where_clause = " AND ".join(conditions)
-            sql = "SELECT COUNT(*) FROM {} WHERE {}".format(
-                self.table_name, where_clause
-            )
-            cursor.execute(sql, params)
-            return cursor.fetchone()[0] > 0
+        # Same lookups as filter(); StoreQuerySet.exists() probes with LIMIT 1
+        return self.filter(**kwargs).exists()
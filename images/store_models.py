@@ -3,27 +3,20 @@ Dynamic model system for store-specific tables.
 Each store gets its own set of tables: store_{store_id}_categories, store_{store_id}_products, store_{store_id}_images
 """
 
-import os
-import re
+from functools import lru_cache
 
 from django.apps import apps
 from django.contrib.auth.models import User
 from django.db import models
+from django.urls import reverse
 
-
-def generate_image_code(filename):
-    """Generate image code from filename: lowercase, words separated by underscores"""
-    # Remove file extension
-    name = os.path.splitext(filename)[0]
-    # Replace spaces and special characters with underscores
-    name = re.sub(r"[^a-zA-Z0-9\s]", "", name)
-    # Replace multiple spaces with single space
-    name = re.sub(r"\s+", " ", name)
-    # Convert to lowercase and replace spaces with underscores
-    code = name.lower().strip().replace(" ", "_")
-    # Remove multiple underscores
-    code = re.sub(r"_+", "_", code)
-    return code
+from .models import (
+    Store,
+    cached_slugify,
+    clean_image_code,
+    code_prefix_q,
+    generate_image_code,
+)
 
 
 def get_store_category_model(store_id):
@@ -119,44 +112,45 @@ def get_store_image_model(store_id, product_model):
                 self.image_code = generate_image_code(self.name)
         else:
             # Clean the provided image_code
-            self.image_code = self.image_code.strip().lower()
-            # Replace spaces with underscores
-            self.image_code = re.sub(r"\s+", "_", self.image_code)
-            # Remove invalid characters
-            self.image_code = re.sub(r"[^a-z0-9_]", "", self.image_code)
-            # Remove multiple underscores
-            self.image_code = re.sub(r"_+", "_", self.image_code)
-            self.image_code = self.image_code.strip("_")
+            self.image_code = clean_image_code(self.image_code)
 
         # Ensure uniqueness within this store's table
         original_code = self.image_code
-        counter = 1
-        # Get the model class for this store to check uniqueness
-        ImageModel = get_store_image_model(store_id, product_model)
-        while (
-            ImageModel.objects.filter(image_code=self.image_code)
+        # The class this method belongs to; "model" is bound below before
+        # any instance can be saved, so no registry lookup is needed
+        ImageModel = model
+        # Fetch every code sharing the prefix in one query and pick the
+        # first free suffix in memory
+        taken = set(
+            ImageModel.objects.filter(code_prefix_q(original_code))
             .exclude(pk=self.pk)
-            .exists()
-        ):
+            .order_by()
+            .values_list("image_code", flat=True)
+        )
+        if original_code in taken:
+            counter = 1
+            while f"{original_code}_{counter}" in taken:
+                counter += 1
             self.image_code = f"{original_code}_{counter}"
-            counter += 1
 
         super(ImageModel, self).save(*args, **kwargs)
 
-    def get_absolute_url(self):
+    def get_absolute_url(self, store=None):
         """Return publicly accessible URL for the image"""
-        from django.urls import reverse
-        from django.utils.text import slugify
-
-        from .models import Store
-
-        store = Store.objects.get(id=store_id)
+        # Listings pass the store they already have; otherwise only its
+        # name is read
+        if store is not None:
+            store_name = store.name
+        else:
+            store_name = Store.objects.values_list("name", flat=True).get(
+                id=store_id
+            )
         return reverse(
             "image_view",
             kwargs={
-                "store_name": slugify(store.name),
-                "category_name": slugify(self.product.category.name),
-                "product_name": slugify(self.product.name),
+                "store_name": cached_slugify(store_name),
+                "category_name": cached_slugify(self.product.category.name),
+                "product_name": cached_slugify(self.product.name),
                 "image_code": self.image_code,
             },
         )
@@ -183,3 +177,12 @@ def get_store_image_model(store_id, product_model):
     model = type(model_name, (models.Model,), attrs)
     apps.all_models["images"][model_name] = model
     return model
+
+
+@lru_cache(maxsize=None)
+def get_store_models(store_id):
+    """Return the (Category, Product, Image) models for a store, built once per process"""
+    category_model = get_store_category_model(store_id)
+    product_model = get_store_product_model(store_id, category_model)
+    image_model = get_store_image_model(store_id, product_model)
+    return category_model, product_model, image_model
@@ -7,7 +7,101 @@ import os
 
 from django.apps import apps
 from django.core.management import call_command
-from django.db import connection
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .sqlite_maintenance import (
+    apply_statements,
+    columns_by_table,
+    store_table_name,
+    table_columns_query,
+)
+from .store_helpers import (
+    StoreCategory,
+    StoreImage,
+    StoreProduct,
+    filter_conditions,
+)
+
+
+def store_table_ddl(store_id):
+    """Return the CREATE TABLE statements for a store's three tables"""
+    categories = store_table_name(store_id, "categories")
+    products = store_table_name(store_id, "products")
+    images = store_table_name(store_id, "images")
+    return [
+        # Categories table
+        f"""
+        CREATE TABLE IF NOT EXISTS {categories} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name VARCHAR(200) NOT NULL,
+            created_at DATETIME NOT NULL,
+            updated_at DATETIME NOT NULL
+        )""",
+        # Products table
+        f"""
+        CREATE TABLE IF NOT EXISTS {products} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category_id INTEGER NOT NULL,
+            name VARCHAR(200) NOT NULL,
+            marked_price DECIMAL(10, 2),
+            min_discounted_price DECIMAL(10, 2),
+            description TEXT,
+            created_at DATETIME NOT NULL,
+            updated_at DATETIME NOT NULL,
+            FOREIGN KEY (category_id) REFERENCES {categories}(id) ON DELETE CASCADE
+        )""",
+        # Images table
+        f"""
+        CREATE TABLE IF NOT EXISTS {images} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL,
+            name VARCHAR(200) NOT NULL,
+            image_code VARCHAR(200) NOT NULL,
+            image_file VARCHAR(100),
+            url VARCHAR(500),
+            created_at DATETIME NOT NULL,
+            updated_at DATETIME NOT NULL,
+            FOREIGN KEY (product_id) REFERENCES {products}(id) ON DELETE CASCADE
+        )""",
+    ]
+
+
+def store_index_ddl(store_id):
+    """Return the CREATE/DROP INDEX statements for a store's tables"""
+    categories = store_table_name(store_id, "categories")
+    products = store_table_name(store_id, "products")
+    images = store_table_name(store_id, "images")
+    return [
+        # Create unique index on image_code (SQLite doesn't support UNIQUE in CREATE TABLE the same way)
+        f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{images}_code_unique ON {images}(image_code)",
+        # Create indexes for better performance
+        f"CREATE INDEX IF NOT EXISTS idx_{categories}_name ON {categories}(name)",
+        f"CREATE INDEX IF NOT EXISTS idx_{products}_name ON {products}(name)",
+        # Products of a category and images of a product are always listed
+        # in name / created_at order; composite indexes return them already
+        # sorted instead of sorting every result
+        f"CREATE INDEX IF NOT EXISTS idx_{products}_category_name ON {products}(category_id, name)",
+        f"CREATE INDEX IF NOT EXISTS idx_{images}_product_created ON {images}(product_id, created_at)",
+        # The single-column indexes they replace are prefixes of these
+        f"DROP INDEX IF EXISTS idx_{products}_category",
+        f"DROP INDEX IF EXISTS idx_{images}_product",
+    ]
+
+
+def execute_ddl(statements):
+    """
+    Run DDL statements as one BEGIN ... COMMIT script instead of one execute()
+    round trip each. executescript() commits any open transaction first, so
+    inside an atomic() block they run one by one in the caller's transaction.
+    """
+    if connection.in_atomic_block:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+        return
+    connection.ensure_connection()
+    apply_statements(connection.connection, statements)
 
 
 def create_store_tables(store_id):
@@ -15,142 +109,147 @@ def create_store_tables(store_id):
     Create database tables for a specific store.
     Creates: store_{store_id}_categories, store_{store_id}_products, store_{store_id}_images
     """
-    from django.db import connection
+    execute_ddl(store_table_ddl(store_id) + store_index_ddl(store_id))
+
+
+def create_store_indexes(store_id):
+    """
+    Create the indexes for a specific store's tables.
+    Safe to run again on existing stores to backfill indexes added later.
+    """
+    execute_ddl(store_index_ddl(store_id))
 
+
+def get_store_table_columns(suffix):
+    """Return {table_name: set of column names} for every store_*_{suffix} table"""
     with connection.cursor() as cursor:
-        # Create categories table
-        cursor.execute(
-            f"""
-            CREATE TABLE IF NOT EXISTS store_{store_id}_categories (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name VARCHAR(200) NOT NULL,
-                created_at DATETIME NOT NULL,
-                updated_at DATETIME NOT NULL
-            )
-        """
-        )
+        cursor.execute(*table_columns_query(suffix))
+        return columns_by_table(cursor.fetchall())
 
-        # Create products table
-        cursor.execute(
-            f"""
-            CREATE TABLE IF NOT EXISTS store_{store_id}_products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                category_id INTEGER NOT NULL,
-                name VARCHAR(200) NOT NULL,
-                marked_price DECIMAL(10, 2),
-                min_discounted_price DECIMAL(10, 2),
-                description TEXT,
-                created_at DATETIME NOT NULL,
-                updated_at DATETIME NOT NULL,
-                FOREIGN KEY (category_id) REFERENCES store_{store_id}_categories(id) ON DELETE CASCADE
-            )
-        """
-        )
 
-        # Create images table
+def get_store_table_names():
+    """Return the set of all existing store_* table names"""
+    with connection.cursor() as cursor:
         cursor.execute(
-            f"""
-            CREATE TABLE IF NOT EXISTS store_{store_id}_images (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                product_id INTEGER NOT NULL,
-                name VARCHAR(200) NOT NULL,
-                image_code VARCHAR(200) NOT NULL,
-                image_file VARCHAR(100),
-                url VARCHAR(500),
-                created_at DATETIME NOT NULL,
-                updated_at DATETIME NOT NULL,
-                FOREIGN KEY (product_id) REFERENCES store_{store_id}_products(id) ON DELETE CASCADE
-            )
-        """
+            "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE ? ESCAPE '\\'",
+            ["store\\_%"],
         )
+        return {row[0] for row in cursor.fetchall()}
 
-        # Create unique index on image_code (SQLite doesn't support UNIQUE in CREATE TABLE the same way)
-        cursor.execute(
-            f"CREATE UNIQUE INDEX IF NOT EXISTS idx_store_{store_id}_images_code_unique ON store_{store_id}_images(image_code)"
-        )
 
-        # Create indexes for better performance
-        cursor.execute(
-            f"CREATE INDEX IF NOT EXISTS idx_store_{store_id}_categories_name ON store_{store_id}_categories(name)"
-        )
-        cursor.execute(
-            f"CREATE INDEX IF NOT EXISTS idx_store_{store_id}_products_category ON store_{store_id}_products(category_id)"
-        )
-        cursor.execute(
-            f"CREATE INDEX IF NOT EXISTS idx_store_{store_id}_products_name ON store_{store_id}_products(name)"
-        )
-        cursor.execute(
-            f"CREATE INDEX IF NOT EXISTS idx_store_{store_id}_images_product ON store_{store_id}_images(product_id)"
-        )
+def count_store_rows(store_id, suffix):
+    """Return the number of rows in one of a store's tables"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM {store_table_name(store_id, suffix)}")
+        return cursor.fetchone()[0]
+
+
+def get_store_counts(store_ids):
+    """
+    Return {store_id: (product_count, image_count)} for the given stores.
+    All counts are read with one UNION ALL query; stores whose tables
+    don't exist are reported as (0, 0).
+    """
+    counts = {store_id: (0, 0) for store_id in store_ids}
+    existing = get_store_table_names()
+    with connection.cursor() as cursor:
+        selects = []
+        for store_id in store_ids:
+            products = store_table_name(store_id, "products")
+            images = store_table_name(store_id, "images")
+            if products in existing and images in existing:
+                selects.append(
+                    f"SELECT {store_id}, (SELECT COUNT(*) FROM {products}), "
+                    f"(SELECT COUNT(*) FROM {images})"
+                )
+
+        # SQLite caps compound SELECTs at 500 terms by default
+        for start in range(0, len(selects), 500):
+            cursor.execute(" UNION ALL ".join(selects[start : start + 500]))
+            for store_id, product_count, image_count in cursor.fetchall():
+                counts[store_id] = (product_count, image_count)
+    return counts
+
+
+def optimize_database():
+    """Refresh SQLite's query planner statistics after schema changes"""
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA optimize")
 
 
 def drop_store_tables(store_id):
     """Drop all tables for a specific store"""
     with connection.cursor() as cursor:
-        cursor.execute(f"DROP TABLE IF EXISTS store_{store_id}_images")
-        cursor.execute(f"DROP TABLE IF EXISTS store_{store_id}_products")
-        cursor.execute(f"DROP TABLE IF EXISTS store_{store_id}_categories")
+        for suffix in ("images", "products", "categories"):
+            cursor.execute(f"DROP TABLE IF EXISTS {store_table_name(store_id, suffix)}")
+
+
+def bulk_insert(table_name, columns, rows):
+    """Insert dicts that share the same keys with one executemany in one transaction"""
+    if not rows:
+        return
+    keys = list(rows[0])
+    # Keys become column names in the SQL, so only known columns are allowed;
+    # the timestamps are always set here
+    for key in keys:
+        if key not in columns or key in ("created_at", "updated_at"):
+            raise ValueError(f"Invalid column for {table_name}: {key!r}")
+    for index, row in enumerate(rows):
+        if row.keys() != rows[0].keys():
+            raise ValueError(
+                f"Row {index} has keys {sorted(row)}, expected {sorted(keys)}"
+            )
+    now = timezone.now()
+    field_names = ", ".join(keys + ["created_at", "updated_at"])
+    placeholders = ", ".join(["?"] * (len(keys) + 2))
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {table_name} ({field_names}) VALUES ({placeholders})",
+            [[row[key] for key in keys] + [now, now] for row in rows],
+        )
 
 
 class StoreCategoryManager:
     """Manager for store-specific Category operations"""
 
+    columns = StoreCategory.COLUMNS
+
     def __init__(self, store_id):
-        self.store_id = store_id
-        self.table_name = f"store_{store_id}_categories"
+        # int() keeps the table name safe; fixed statements are built once here
+        self.store_id = int(store_id)
+        self.table_name = store_table_name(self.store_id, "categories")
+        self.select_sql = f"SELECT {', '.join(self.columns)} FROM {self.table_name}"
+        self.all_sql = f"{self.select_sql} ORDER BY name"
+        self.delete_sql = f"DELETE FROM {self.table_name} WHERE id = ?"
 
     def all(self):
         with connection.cursor() as cursor:
-            cursor.execute(f"SELECT * FROM {self.table_name} ORDER BY name")
-            columns = [col[0] for col in cursor.description]
-            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            cursor.execute(self.all_sql)
+            return [dict(zip(self.columns, row)) for row in cursor.fetchall()]
 
     def get(self, **kwargs):
+        conditions, params = filter_conditions(kwargs, self.columns)
         with connection.cursor() as cursor:
-            conditions = []
-            params = []
-            for key, value in kwargs.items():
-                conditions.append(f"{key} = ?")
-                params.append(value)
-            where_clause = " AND ".join(conditions)
             cursor.execute(
-                f"SELECT * FROM {self.table_name} WHERE {where_clause}", params
+                f"{self.select_sql} WHERE {' AND '.join(conditions)}", params
             )
-            columns = [col[0] for col in cursor.description]
             row = cursor.fetchone()
             if row:
-                return dict(zip(columns, row))
+                return dict(zip(self.columns, row))
             return None
 
     def filter(self, **kwargs):
+        conditions, params = filter_conditions(kwargs, self.columns)
+        where_clause = " AND ".join(conditions) if conditions else "1=1"
         with connection.cursor() as cursor:
-            conditions = []
-            params = []
-            for key, value in kwargs.items():
-                if "__" in key:
-                    # Handle lookups like name__icontains
-                    field, lookup = key.split("__", 1)
-                    if lookup == "icontains":
-                        conditions.append(f"{field} LIKE ?")
-                        params.append(f"%{value}%")
-                    else:
-                        conditions.append(f"{field} = ?")
-                        params.append(value)
-                else:
-                    conditions.append(f"{key} = ?")
-                    params.append(value)
-            where_clause = " AND ".join(conditions) if conditions else "1=1"
             cursor.execute(
-                f"SELECT * FROM {self.table_name} WHERE {where_clause} ORDER BY name",
+                f"{self.select_sql} WHERE {where_clause} ORDER BY name",
                 params,
             )
-            columns = [col[0] for col in cursor.description]
-            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            return [dict(zip(self.columns, row)) for row in cursor.fetchall()]
 
     def create(self, **kwargs):
         with connection.cursor() as cursor:
-            from django.utils import timezone
-
             now = timezone.now()
             fields = list(kwargs.keys()) + ["created_at", "updated_at"]
             values = list(kwargs.values()) + [now, now]
@@ -162,73 +261,56 @@ class StoreCategoryManager:
             )
             return cursor.lastrowid
 
+    def bulk_create(self, rows):
+        """Insert many rows (dicts with the same keys); ids are not returned"""
+        bulk_insert(self.table_name, self.columns, rows)
+
     def delete(self, id):
         with connection.cursor() as cursor:
-            cursor.execute(f"DELETE FROM {self.table_name} WHERE id = ?", [id])
+            cursor.execute(self.delete_sql, [id])
 
 
 class StoreProductManager:
     """Manager for store-specific Product operations"""
 
+    columns = StoreProduct.COLUMNS
+
     def __init__(self, store_id):
-        self.store_id = store_id
-        self.table_name = f"store_{store_id}_products"
+        # int() keeps the table name safe; fixed statements are built once here
+        self.store_id = int(store_id)
+        self.table_name = store_table_name(self.store_id, "products")
+        self.select_sql = f"SELECT {', '.join(self.columns)} FROM {self.table_name}"
+        self.all_sql = f"{self.select_sql} ORDER BY name"
+        self.delete_sql = f"DELETE FROM {self.table_name} WHERE id = ?"
 
     def all(self):
         with connection.cursor() as cursor:
-            cursor.execute(f"SELECT * FROM {self.table_name} ORDER BY name")
-            columns = [col[0] for col in cursor.description]
-            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            cursor.execute(self.all_sql)
+            return [dict(zip(self.columns, row)) for row in cursor.fetchall()]
 
     def get(self, **kwargs):
+        conditions, params = filter_conditions(kwargs, self.columns)
         with connection.cursor() as cursor:
-            conditions = []
-            params = []
-            for key, value in kwargs.items():
-                conditions.append(f"{key} = ?")
-                params.append(value)
-            where_clause = " AND ".join(conditions)
             cursor.execute(
-                f"SELECT * FROM {self.table_name} WHERE {where_clause}", params
+                f"{self.select_sql} WHERE {' AND '.join(conditions)}", params
             )
-            columns = [col[0] for col in cursor.description]
             row = cursor.fetchone()
             if row:
-                return dict(zip(columns, row))
+                return dict(zip(self.columns, row))
             return None
 
     def filter(self, **kwargs):
+        conditions, params = filter_conditions(kwargs, self.columns)
+        where_clause = " AND ".join(conditions) if conditions else "1=1"
         with connection.cursor() as cursor:
-            conditions = []
-            params = []
-            for key, value in kwargs.items():
-                if "__" in key:
-                    field, lookup = key.split("__", 1)
-                    if lookup == "icontains":
-                        conditions.append(f"{field} LIKE ?")
-                        params.append(f"%{value}%")
-                    elif lookup == "in":
-                        placeholders = ", ".join(["?" for _ in value])
-                        conditions.append(f"{field} IN ({placeholders})")
-                        params.extend(value)
-                    else:
-                        conditions.append(f"{field} = ?")
-                        params.append(value)
-                else:
-                    conditions.append(f"{key} = ?")
-                    params.append(value)
-            where_clause = " AND ".join(conditions) if conditions else "1=1"
             cursor.execute(
-                f"SELECT * FROM {self.table_name} WHERE {where_clause} ORDER BY name",
+                f"{self.select_sql} WHERE {where_clause} ORDER BY name",
                 params,
             )
-            columns = [col[0] for col in cursor.description]
-            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            return [dict(zip(self.columns, row)) for row in cursor.fetchall()]
 
     def create(self, **kwargs):
         with connection.cursor() as cursor:
-            from django.utils import timezone
-
             now = timezone.now()
             fields = list(kwargs.keys()) + ["created_at", "updated_at"]
             values = list(kwargs.values()) + [now, now]
@@ -240,69 +322,56 @@ class StoreProductManager:
             )
             return cursor.lastrowid
 
+    def bulk_create(self, rows):
+        """Insert many rows (dicts with the same keys); ids are not returned"""
+        bulk_insert(self.table_name, self.columns, rows)
+
     def delete(self, id):
         with connection.cursor() as cursor:
-            cursor.execute(f"DELETE FROM {self.table_name} WHERE id = ?", [id])
+            cursor.execute(self.delete_sql, [id])
 
 
 class StoreImageManager:
     """Manager for store-specific Image operations"""
 
+    columns = StoreImage.COLUMNS
+
     def __init__(self, store_id):
-        self.store_id = store_id
-        self.table_name = f"store_{store_id}_images"
+        # int() keeps the table name safe; fixed statements are built once here
+        self.store_id = int(store_id)
+        self.table_name = store_table_name(self.store_id, "images")
+        self.select_sql = f"SELECT {', '.join(self.columns)} FROM {self.table_name}"
+        self.all_sql = f"{self.select_sql} ORDER BY created_at DESC"
+        self.delete_sql = f"DELETE FROM {self.table_name} WHERE id = ?"
 
     def all(self):
         with connection.cursor() as cursor:
-            cursor.execute(f"SELECT * FROM {self.table_name} ORDER BY created_at DESC")
-            columns = [col[0] for col in cursor.description]
-            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            cursor.execute(self.all_sql)
+            return [dict(zip(self.columns, row)) for row in cursor.fetchall()]
 
     def get(self, **kwargs):
+        conditions, params = filter_conditions(kwargs, self.columns)
         with connection.cursor() as cursor:
-            conditions = []
-            params = []
-            for key, value in kwargs.items():
-                conditions.append(f"{key} = ?")
-                params.append(value)
-            where_clause = " AND ".join(conditions)
             cursor.execute(
-                f"SELECT * FROM {self.table_name} WHERE {where_clause}", params
+                f"{self.select_sql} WHERE {' AND '.join(conditions)}", params
             )
-            columns = [col[0] for col in cursor.description]
             row = cursor.fetchone()
             if row:
-                return dict(zip(columns, row))
+                return dict(zip(self.columns, row))
             return None
 
     def filter(self, **kwargs):
+        conditions, params = filter_conditions(kwargs, self.columns)
+        where_clause = " AND ".join(conditions) if conditions else "1=1"
         with connection.cursor() as cursor:
-            conditions = []
-            params = []
-            for key, value in kwargs.items():
-                if "__" in key:
-                    field, lookup = key.split("__", 1)
-                    if lookup == "icontains":
-                        conditions.append(f"{field} LIKE ?")
-                        params.append(f"%{value}%")
-                    else:
-                        conditions.append(f"{field} = ?")
-                        params.append(value)
-                else:
-                    conditions.append(f"{key} = ?")
-                    params.append(value)
-            where_clause = " AND ".join(conditions) if conditions else "1=1"
             cursor.execute(
-                f"SELECT * FROM {self.table_name} WHERE {where_clause} ORDER BY created_at DESC",
+                f"{self.select_sql} WHERE {where_clause} ORDER BY created_at DESC",
                 params,
             )
-            columns = [col[0] for col in cursor.description]
-            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            return [dict(zip(self.columns, row)) for row in cursor.fetchall()]
 
     def create(self, **kwargs):
         with connection.cursor() as cursor:
-            from django.utils import timezone
-
             now = timezone.now()
             fields = list(kwargs.keys()) + ["created_at", "updated_at"]
             values = list(kwargs.values()) + [now, now]
@@ -314,10 +383,12 @@ class StoreImageManager:
             )
             return cursor.lastrowid
 
+    def bulk_create(self, rows):
+        """Insert many rows (dicts with the same keys); ids are not returned"""
+        bulk_insert(self.table_name, self.columns, rows)
+
     def update(self, id, **kwargs):
         with connection.cursor() as cursor:
-            from django.utils import timezone
-
             set_clauses = []
             params = []
             for key, value in kwargs.items():
@@ -333,17 +404,14 @@ class StoreImageManager:
 
     def delete(self, id):
         with connection.cursor() as cursor:
-            cursor.execute(f"DELETE FROM {self.table_name} WHERE id = ?", [id])
+            cursor.execute(self.delete_sql, [id])
 
     def exists(self, **kwargs):
+        conditions, params = filter_conditions(kwargs, self.columns)
+        where_clause = " AND ".join(conditions)
         with connection.cursor() as cursor:
-            conditions = []
-            params = []
-            for key, value in kwargs.items():
-                conditions.append(f"{key} = ?")
-                params.append(value)
-            where_clause = " AND ".join(conditions)
+            # LIMIT 1 lets SQLite stop at the first match instead of counting
             cursor.execute(
-                f"SELECT COUNT(*) FROM {self.table_name} WHERE {where_clause}", params
+                f"SELECT 1 FROM {self.table_name} WHERE {where_clause} LIMIT 1", params
             )
-            return cursor.fetchone()[0] > 0
+            return cursor.fetchone() is not None
@@ -1,20 +1,39 @@
 import json
 import os
 import re
+from collections import defaultdict
+from urllib.parse import urlparse
 
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
+from django.db import transaction
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
 from .forms import CategoryForm, ImageUploadForm, ProductForm, StoreForm
-from .models import Category, Image, Product, Store
+from .models import (
+    INVALID_CODE_RE,
+    UNDERSCORES_RE,
+    Category,
+    Image,
+    Product,
+    Store,
+    cached_slugify,
+)
+
+# Separators between the URLs of a bulk-upload CSV "Image URLs" cell
+URL_SEPARATOR_RE = re.compile(r"[;,]")
+
+
+def strip_image_code(code):
+    """Lowercase a submitted image code and drop characters outside [a-z0-9_]"""
+    code = INVALID_CODE_RE.sub("", code.strip().lower())
+    return UNDERSCORES_RE.sub("_", code).strip("_")
 
 
 def register_view(request):
@@ -91,8 +110,6 @@ def store_create(request):
 @login_required
 def store_detail(request, store_id):
     """View store details with categories and all images"""
-    from django.utils.text import slugify
-
     from .store_helpers import StoreCategory, StoreImage, StoreProduct
 
     store = get_object_or_404(Store, id=store_id, user=request.user)
@@ -100,35 +117,36 @@ def store_detail(request, store_id):
     # Get categories from store-specific table
     categories = StoreCategory.objects(store_id).all()
 
+    # Load every product and image of the store once and group them here,
+    # instead of querying per category and per product
+    products_by_category = defaultdict(list)
+    for product in StoreProduct.objects(store_id).all():
+        products_by_category[product.category_id].append(product)
+    images_by_product = defaultdict(list)
+    for image in StoreImage.objects(store_id).all():
+        images_by_product[image.product_id].append(image)
+
     # Create a dictionary of category_id -> product count for template
-    category_product_counts = {}
-    for category in categories:
-        category_products = StoreProduct.objects(store_id).filter(
-            category_id=category.id
-        )
-        category_product_counts[category.id] = len(category_products)
+    category_product_counts = {
+        category.id: len(products_by_category[category.id]) for category in categories
+    }
 
     # Collect all images organized by category and product
     images_by_category = []
     for category in categories:
         # Get products for this category
-        products = StoreProduct.objects(store_id).filter(category_id=category.id)
+        products = products_by_category[category.id]
         products_data = []
         for product in products:
-            # Get images for this product
-            images = StoreImage.objects(store_id).filter(product_id=product.id)
+            # Hand the loaded rows to the models so get_absolute_url() needs
+            # no queries
+            product.category = category
+            images = images_by_product[product.id]
             images_data = []
             for image in images:
+                image.product = product
                 image_url = request.build_absolute_uri(
-                    reverse(
-                        "image_view",
-                        kwargs={
-                            "store_name": slugify(store.name),
-                            "category_name": slugify(category.name),
-                            "product_name": slugify(product.name),
-                            "image_code": image.image_code,
-                        },
-                    )
+                    image.get_absolute_url(store=store)
                 )
                 images_data.append(
                     {
@@ -333,10 +351,7 @@ def product_detail(request, store_id, product_id):
                 image_code = ""
                 if idx < len(image_codes) and image_codes[idx].strip():
                     # Clean the provided image code
-                    code = image_codes[idx].strip().lower()
-                    code = re.sub(r"[^a-z0-9_]", "", code)
-                    code = re.sub(r"_+", "_", code)
-                    code = code.strip("_")
+                    code = strip_image_code(image_codes[idx])
                     if code:
                         image_code = code
 
@@ -370,18 +385,13 @@ def product_detail(request, store_id, product_id):
                     label = url_labels[idx].strip()
                 else:
                     # Use last part of URL as label fallback
-                    import os
-                    from urllib.parse import urlparse
                     path = urlparse(url).path
                     label = os.path.basename(path) or "Image from URL"
 
                 # Get code
                 image_code = ""
                 if idx < len(url_codes) and url_codes[idx].strip():
-                    code = url_codes[idx].strip().lower()
-                    code = re.sub(r"[^a-z0-9_]", "", code)
-                    code = re.sub(r"_+", "_", code)
-                    code = code.strip("_")
+                    code = strip_image_code(url_codes[idx])
                     if code:
                         image_code = code
                 
@@ -421,21 +431,10 @@ def product_detail(request, store_id, product_id):
         form = ImageUploadForm()
 
     # Generate full URLs for images
-    from django.utils.text import slugify
-
     image_data = []
     for image in images:
-        image_url = request.build_absolute_uri(
-            reverse(
-                "image_view",
-                kwargs={
-                    "store_name": slugify(store.name),
-                    "category_name": slugify(category.name),
-                    "product_name": slugify(product.name),
-                    "image_code": image.image_code,
-                },
-            )
-        )
+        image.product = product
+        image_url = request.build_absolute_uri(image.get_absolute_url(store=store))
         image_data.append(
             {
                 "id": image.id,
@@ -477,8 +476,6 @@ def image_update(request, store_id, image_id):
 
     store = get_object_or_404(Store, id=store_id, user=request.user)
     image = StoreImage.objects(store_id).get(id=image_id)
-    product = image.product
-    category = product.category
 
     data = json.loads(request.body)
     image.name = data.get("name", image.name).strip()
@@ -486,13 +483,8 @@ def image_update(request, store_id, image_id):
 
     # Validate image_code format
     if new_code:
-        import re
-
         # Clean the code: lowercase, underscores only
-        new_code = new_code.lower()
-        new_code = re.sub(r"[^a-z0-9_]", "", new_code)
-        new_code = re.sub(r"_+", "_", new_code)
-        new_code = new_code.strip("_")
+        new_code = strip_image_code(new_code)
 
         if not new_code:
             return JsonResponse(
@@ -503,7 +495,6 @@ def image_update(request, store_id, image_id):
 
     try:
         image.save()
-        from django.utils.text import slugify
 
         return JsonResponse(
             {
@@ -514,15 +505,7 @@ def image_update(request, store_id, image_id):
                     "name": image.name,
                     "image_code": image.image_code,
                     "url": request.build_absolute_uri(
-                        reverse(
-                            "image_view",
-                            kwargs={
-                                "store_name": slugify(store.name),
-                                "category_name": slugify(category.name),
-                                "product_name": slugify(product.name),
-                                "image_code": image.image_code,
-                            },
-                        )
+                        image.get_absolute_url(store=store)
                     ),
                 },
             }
@@ -548,7 +531,6 @@ def image_delete(request, store_id, image_id):
 def api_search_product(request):
     """API endpoint to search for products by name and return image URLs with fuzzy search (store-scoped)"""
     from django.db import connection
-    from django.utils.text import slugify
     from rapidfuzz import fuzz, process
 
     try:
@@ -620,8 +602,10 @@ def api_search_product(request):
         # Filter products by store first
         # First try exact/partial match (case-insensitive) within the store
         try:
-            products = StoreProduct.objects(store.id).filter(
-                name__icontains=product_name
+            products = list(
+                StoreProduct.objects(store.id).filter(
+                    name__icontains=product_name, select_related=("category",)
+                )
             )
         except Exception as e:
             return JsonResponse(
@@ -634,7 +618,9 @@ def api_search_product(request):
         if not products:
             used_fuzzy = True
             # Get all products in this store for fuzzy matching
-            all_products = StoreProduct.objects(store.id).all()
+            all_products = StoreProduct.objects(store.id).all(
+                select_related=("category",)
+            )
 
             if all_products:
                 # Create a list of product names with their IDs
@@ -690,16 +676,9 @@ def api_search_product(request):
                 images = StoreImage.objects(store.id).filter(product_id=product.id)
                 images_data = []
                 for image in images:
+                    image.product = product
                     image_url = request.build_absolute_uri(
-                        reverse(
-                            "image_view",
-                            kwargs={
-                                "store_name": slugify(store.name),
-                                "category_name": slugify(category.name if category else "uncategorized"),
-                                "product_name": slugify(product.name),
-                                "image_code": image.image_code,
-                            },
-                        )
+                        image.get_absolute_url(store=store)
                     )
                     images_data.append(
                         {
@@ -914,7 +893,7 @@ def download_sample_csv(request):
 def product_bulk_upload(request, store_id):
     """Bulk upload products via CSV"""
     from .forms import BulkUploadForm
-    from .store_helpers import StoreCategory, StoreProduct
+    from .store_helpers import StoreCategory, StoreImage, StoreProduct
     import csv 
     import io
 
@@ -944,71 +923,71 @@ def product_bulk_upload(request, store_id):
                 products_created = 0
                 categories_created = 0
                 
-                # Process rows
-                for row in reader:
-                    category_name = row.get('Category', '').strip()
-                    product_name = row.get('Name', '').strip()
+                # Process rows in one transaction: SQLite then commits (and
+                # syncs) once for the whole file instead of once per row
+                with transaction.atomic():
+                    for row in reader:
+                        category_name = row.get('Category', '').strip()
+                        product_name = row.get('Name', '').strip()
                     
-                    if not category_name or not product_name:
-                        continue
+                        if not category_name or not product_name:
+                            continue
                         
-                    # Get or Create Category
-                    store_categories = StoreCategory.objects(store_id).filter(name__icontains=category_name)
-                    # Simple case-insensitive name check logic
-                    category = None
-                    for c in store_categories:
-                        if c.name.lower() == category_name.lower():
-                            category = c
-                            break
+                        # Get or Create Category
+                        store_categories = StoreCategory.objects(store_id).filter(name__icontains=category_name)
+                        # Simple case-insensitive name check logic
+                        category = None
+                        for c in store_categories:
+                            if c.name.lower() == category_name.lower():
+                                category = c
+                                break
                     
-                    if not category:
-                        category = StoreCategory.objects(store_id).create(name=category_name)
-                        categories_created += 1
+                        if not category:
+                            category = StoreCategory.objects(store_id).create(name=category_name)
+                            categories_created += 1
                         
-                    # Create Product
-                    marked_price = row.get('Marked Price')
-                    min_discounted_price = row.get('Min Discounted Price')
+                        # Create Product
+                        marked_price = row.get('Marked Price')
+                        min_discounted_price = row.get('Min Discounted Price')
                     
-                    # Clean prices (handle empty strings)
-                    marked_price = float(marked_price) if marked_price and marked_price.strip() else None
-                    min_discounted_price = float(min_discounted_price) if min_discounted_price and min_discounted_price.strip() else None
+                        # Clean prices (handle empty strings)
+                        marked_price = float(marked_price) if marked_price and marked_price.strip() else None
+                        min_discounted_price = float(min_discounted_price) if min_discounted_price and min_discounted_price.strip() else None
                     
-                    product = StoreProduct.objects(store_id).create(
-                        category=category,
-                        name=product_name,
-                        marked_price=marked_price,
-                        min_discounted_price=min_discounted_price,
-                        description=row.get('Description', '').strip()
-                    )
+                        product = StoreProduct.objects(store_id).create(
+                            category=category,
+                            name=product_name,
+                            marked_price=marked_price,
+                            min_discounted_price=min_discounted_price,
+                            description=row.get('Description', '').strip()
+                        )
                     
-                    # Handle Image URLs
-                    image_urls_str = row.get('Image URLs', '').strip()
-                    if image_urls_str:
-                        # Split by comma or semicolon
-                        import re
-                        urls = re.split(r'[;,]', image_urls_str)
-                        for i, url in enumerate(urls):
-                            url = url.strip()
-                            if url:
-                                try:
-                                    # Create StoreImage
-                                    # Generate a code if possible, or let auto-generation handle it
-                                    from urllib.parse import urlparse
-                                    import os
-                                    
-                                    path = urlparse(url).path
-                                    filename = os.path.basename(path) or f"{product_name}_{i+1}"
-                                    
-                                    from .store_helpers import StoreImage
-                                    StoreImage.objects(store_id).create(
-                                        product=product,
-                                        name=filename,
-                                        url=url
-                                    )
-                                except Exception as img_err:
-                                    print(f"Error adding image {url} for {product_name}: {img_err}")
+                        # Handle Image URLs
+                        image_urls_str = row.get('Image URLs', '').strip()
+                        if image_urls_str:
+                            # Split by comma or semicolon
+                            urls = URL_SEPARATOR_RE.split(image_urls_str)
+                            for i, url in enumerate(urls):
+                                url = url.strip()
+                                if url:
+                                    try:
+                                        # Create StoreImage
+                                        # Generate a code if possible, or let auto-generation handle it
+                                        path = urlparse(url).path
+                                        filename = os.path.basename(path) or f"{product_name}_{i+1}"
+
+                                        # Savepoint, so a failed image doesn't
+                                        # abort the whole import
+                                        with transaction.atomic():
+                                            StoreImage.objects(store_id).create(
+                                                product=product,
+                                                name=filename,
+                                                url=url
+                                            )
+                                    except Exception as img_err:
+                                        print(f"Error adding image {url} for {product_name}: {img_err}")
                                     
-                    products_created += 1
+                        products_created += 1
                     
                 messages.success(request, f"Successfully uploaded {products_created} products (New categories: {categories_created})!")
                 return redirect('store_detail', store_id=store.id)
@@ -1028,7 +1007,6 @@ def image_view(request, store_name, category_name, product_name, image_code):
     import mimetypes
 
     from django.http import FileResponse, Http404
-    from django.utils.text import slugify
 
     from .store_helpers import StoreCategory, StoreImage, StoreProduct
 
@@ -1041,19 +1019,18 @@ def image_view(request, store_name, category_name, product_name, image_code):
         raise Http404("Store not found")
 
     # Find image by code in store-specific table
-    images = StoreImage.objects(store.id).filter(image_code=image_code)
-    if not images:
+    image = StoreImage.objects(store.id).filter(image_code=image_code).first()
+    if image is None:
         raise Http404("Image not found")
-    image = images[0]
 
     product = image.product
     category = product.category
 
     # Verify the URL path matches the image's store/category/product (case-insensitive, slugified comparison)
     if (
-        slugify(store.name) != slugify(store_name)
-        or slugify(category.name) != slugify(category_name)
-        or slugify(product.name) != slugify(product_name)
+        cached_slugify(store.name) != cached_slugify(store_name)
+        or cached_slugify(category.name) != cached_slugify(category_name)
+        or cached_slugify(product.name) != cached_slugify(product_name)
     ):
         raise Http404("Image not found")
 
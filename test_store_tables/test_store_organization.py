@@ -17,17 +17,39 @@ sys.path.insert(0, str(project_root))
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "imagehost.settings")
 django.setup()
 
+import shutil
+import sqlite3
+import subprocess
+import tempfile
 from io import BytesIO
+from unittest import mock
 
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.db import connection
-from django.test import Client, TestCase
+from django.db import IntegrityError, connection, transaction
+from django.test import Client, SimpleTestCase, TestCase, override_settings
 from PIL import Image as PILImage
 
-from images.models import Store
-from images.store_helpers import StoreCategory, StoreImage, StoreProduct
-from images.store_tables import create_store_tables, drop_store_tables
+from images.models import (
+    IMAGE_CODE_RETRIES,
+    Category,
+    Image,
+    Product,
+    Store,
+    compress_stored_image,
+)
+from images.store_helpers import (
+    StoreCategory,
+    StoreImage,
+    StoreProduct,
+    process_store_image,
+)
+from images.store_tables import (
+    StoreCategoryManager,
+    create_store_tables,
+    drop_store_tables,
+    get_store_table_columns,
+)
 
 
 class StoreTableOrganizationTest(TestCase):
@@ -64,6 +86,16 @@ class StoreTableOrganizationTest(TestCase):
             "test_image.jpg", img_io.read(), content_type="image/jpeg"
         )
 
+    def test_invalid_store_id_rejected(self):
+        """Non-integer store ids raise before any table name reaches the SQL"""
+        for store_id in ("1; DROP TABLE images_store --", "1", 1.5, True, None):
+            with self.subTest(store_id=store_id):
+                with self.assertRaises(ValueError):
+                    create_store_tables(store_id)
+                with self.assertRaises(ValueError):
+                    drop_store_tables(store_id)
+        self.assertTrue(Store.objects.exists())
+
     def test_store_tables_created(self):
         """Test that tables are created for each store"""
         with connection.cursor() as cursor:
@@ -85,6 +117,15 @@ class StoreTableOrganizationTest(TestCase):
             self.assertIn("store_2_products", store2_tables)
             self.assertIn("store_2_images", store2_tables)
 
+    def test_get_store_table_columns(self):
+        """Test that store table columns are read for every store in one scan"""
+        tables = get_store_table_columns("products")
+        for store in (self.store1, self.store2):
+            columns = tables[f"store_{store.id}_products"]
+            self.assertIn("category_id", columns)
+            self.assertIn("description", columns)
+        self.assertNotIn(f"store_{self.store1.id}_images", tables)
+
     def test_category_isolation(self):
         """Test that categories are isolated per store"""
         # Create categories in store1
@@ -274,6 +315,43 @@ class StoreTableOrganizationTest(TestCase):
         self.assertEqual(img1.product.name, prod1.name)
         self.assertEqual(img1.product.category.name, cat1.name)
 
+    def test_select_related(self):
+        """Test that select_related attaches related rows without extra queries"""
+        cat1 = StoreCategory.objects(self.store1.id).create(name="Electronics")
+        cat2 = StoreCategory.objects(self.store1.id).create(name="Clothing")
+        prod1 = StoreProduct.objects(self.store1.id).create(
+            category=cat1, name="iPhone"
+        )
+        prod2 = StoreProduct.objects(self.store1.id).create(
+            category=cat2, name="T-Shirt"
+        )
+        for prod in (prod1, prod2):
+            StoreImage.objects(self.store1.id).create(
+                product=prod, name=prod.name, image_code=prod.name
+            )
+
+        products = list(
+            StoreProduct.objects(self.store1.id).all(select_related=("category",))
+        )
+        images = list(
+            StoreImage.objects(self.store1.id).all(
+                select_related=("product__category",)
+            )
+        )
+
+        queries = []
+        connection.connection.set_trace_callback(queries.append)
+        try:
+            product_categories = {p.name: p.category.name for p in products}
+            image_categories = {i.name: i.product.category.name for i in images}
+        finally:
+            connection.connection.set_trace_callback(None)
+
+        self.assertEqual(queries, [])
+        expected = {"iPhone": "Electronics", "T-Shirt": "Clothing"}
+        self.assertEqual(product_categories, expected)
+        self.assertEqual(image_categories, expected)
+
     def test_cascade_deletion(self):
         """Test that cascade deletion works correctly"""
         # Create category, product, and image
@@ -442,6 +520,585 @@ class StoreTableIntegrationTest(TestCase):
         self.assertEqual(products[0].category_id, category.id)
 
 
+def make_upload(name="photo.jpg", size=(40, 30)):
+    """Return a small JPEG upload"""
+    img_io = BytesIO()
+    PILImage.new("RGB", size, color="blue").save(img_io, format="JPEG")
+    return SimpleUploadedFile(name, img_io.getvalue(), content_type="image/jpeg")
+
+
+class TempMediaMixin:
+    """Store uploads in a throwaway MEDIA_ROOT"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_override = override_settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        super().setUp()
+
+
+def trace_sql(test):
+    """Collect every SQL statement the test's connection runs from now on"""
+    statements = []
+    connection.ensure_connection()
+    connection.connection.set_trace_callback(statements.append)
+    test.addCleanup(connection.connection.set_trace_callback, None)
+    return statements
+
+
+class ImageSlugSyncTest(TempMediaMixin, TestCase):
+    """Test that the URL slugs copied onto Image follow renames and moves"""
+
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user(username="sluguser", password="pw")
+        self.store = Store.objects.create(name="Main Store", user=user)
+        self.other_store = Store.objects.create(name="Outlet", user=user)
+        self.category = Category.objects.create(store=self.store, name="Shoes")
+        self.product = Product.objects.create(category=self.category, name="Red Shoe")
+        self.image = Image.objects.create(
+            product=self.product, name="Front", image_file=make_upload()
+        )
+
+    def slugs(self):
+        image = Image.objects.get(pk=self.image.pk)
+        return image.store_slug, image.category_slug, image.product_slug
+
+    def test_unchanged_save_skips_image_update(self):
+        """Saving without a name or parent change doesn't touch images"""
+        store = Store.objects.get(pk=self.store.pk)
+        category = Category.objects.get(pk=self.category.pk)
+        product = Product.objects.get(pk=self.product.pk)
+        statements = trace_sql(self)
+        store.save()
+        category.save()
+        product.save()
+        self.assertFalse([sql for sql in statements if "images_image" in sql])
+
+    def test_renames_update_slugs(self):
+        """Renaming a store, category or product rewrites its slug"""
+        self.store.name = "New Store"
+        self.store.save()
+        self.category.name = "Boots"
+        self.category.save()
+        self.product.name = "Blue Boot"
+        self.product.save()
+        self.assertEqual(self.slugs(), ("new-store", "boots", "blue-boot"))
+
+    def test_update_fields_without_name_keeps_slug(self):
+        """A rename that isn't written doesn't change the slug until it is"""
+        store = Store.objects.get(pk=self.store.pk)
+        store.name = "Unsaved Name"
+        store.save(update_fields=["description"])
+        self.assertEqual(self.slugs()[0], "main-store")
+        store.save()
+        self.assertEqual(self.slugs()[0], "unsaved-name")
+
+    def test_product_move_updates_slugs(self):
+        """Moving a product to a category of another store rewrites both slugs"""
+        sale = Category.objects.create(store=self.other_store, name="Sale")
+        product = Product.objects.get(pk=self.product.pk)
+        product.category = sale
+        product.save()
+        self.assertEqual(self.slugs(), ("outlet", "sale", "red-shoe"))
+
+    def test_category_move_updates_store_slug(self):
+        """Moving a category to another store rewrites the store slug"""
+        category = Category.objects.get(pk=self.category.pk)
+        category.store = self.other_store
+        category.save()
+        self.assertEqual(self.slugs(), ("outlet", "shoes", "red-shoe"))
+
+    def test_image_update_fields_product_writes_slugs(self):
+        """save(update_fields=["product"]) also writes the recomputed slugs"""
+        other_category = Category.objects.create(store=self.other_store, name="Bags")
+        other_product = Product.objects.create(category=other_category, name="Tote")
+        image = Image.objects.get(pk=self.image.pk)
+        image.product = other_product
+        image.save(update_fields=["product"])
+        self.assertEqual(self.slugs(), ("outlet", "bags", "tote"))
+
+
+class ImageFileDetailsTest(TempMediaMixin, TestCase):
+    """Test that an upload's dimensions and size are always written"""
+
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user(username="fileuser", password="pw")
+        store = Store.objects.create(name="Files", user=user)
+        category = Category.objects.create(store=store, name="Cat")
+        self.product = Product.objects.create(category=category, name="Prod")
+
+    def test_update_fields_upload_writes_details(self):
+        """save(update_fields=["image_file"]) also writes width/height/file_size"""
+        image = Image.objects.create(
+            product=self.product, name="Pic", image_file=make_upload()
+        )
+        upload = make_upload("bigger.jpg", size=(80, 60))
+        image.image_file = upload
+        image.save(update_fields=["image_file"])
+
+        stored = Image.objects.get(pk=image.pk)
+        self.assertEqual((stored.width, stored.height), (80, 60))
+        self.assertEqual(stored.file_size, upload.size)
+
+
+class ImageCodeTest(TempMediaMixin, TestCase):
+    """Test image code cleaning and uniqueness on save"""
+
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user(username="codeuser", password="pw")
+        store = Store.objects.create(name="Codes", user=user)
+        category = Category.objects.create(store=store, name="Cat")
+        self.product = Product.objects.create(category=category, name="Prod")
+
+    def test_unwritten_code_is_checked_on_next_save(self):
+        """A code left out of update_fields is still cleaned and made unique later"""
+        Image.objects.create(
+            product=self.product,
+            name="First",
+            image_code="taken",
+            image_file=make_upload(),
+        )
+        image = Image.objects.create(
+            product=self.product, name="Second", image_file=make_upload()
+        )
+        image.image_code = "Taken"
+        image.save(update_fields=["name"])
+        image.save()
+        self.assertEqual(Image.objects.get(pk=image.pk).image_code, "taken_1")
+
+    def test_bulk_create_matches_sequential_saves(self):
+        """bulk_create_with_codes picks the codes one save() per image would"""
+        for code in ("photo", "photo_2"):
+            Image.objects.create(
+                product=self.product, name="Existing", image_code=code, image_file=make_upload()
+            )
+
+        def new_images():
+            return [
+                Image(product=self.product, name="Red Shoe", image_file=make_upload())
+                for _ in range(3)
+            ]
+
+        class Rollback(Exception):
+            pass
+
+        sequential = []
+        try:
+            with transaction.atomic():
+                for image in new_images():
+                    image.save()
+                    sequential.append(image.image_code)
+                raise Rollback
+        except Rollback:
+            pass
+
+        created = Image.bulk_create_with_codes(new_images())
+        self.assertEqual(sequential, ["photo_1", "photo_3", "photo_4"])
+        self.assertEqual([image.image_code for image in created], sequential)
+        self.assertEqual(
+            sorted(Image.objects.filter(name="Red Shoe").values_list("image_code", flat=True)),
+            sequential,
+        )
+
+    def race_for_code(self, times):
+        """Let a concurrent save take the looked-up code the first `times` times"""
+        real = Image.make_image_code_unique
+        calls = []
+
+        def lookup(image, original_code):
+            real(image, original_code)
+            calls.append(image.image_code)
+            if len(calls) <= times:
+                # bulk_create skips save(), like a row written by another process
+                Image.objects.bulk_create(
+                    [
+                        Image(
+                            product=self.product,
+                            name="Racer",
+                            image_code=image.image_code,
+                            image_file="images/racer.jpg",
+                        )
+                    ]
+                )
+
+        patcher = mock.patch.object(
+            Image, "make_image_code_unique", autospec=True, side_effect=lookup
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return calls
+
+    def test_taken_code_is_retried_with_new_suffix(self):
+        """An INSERT that loses the race for a code retries with a fresh suffix"""
+        Image.objects.create(
+            product=self.product, name="First", image_code="pic", image_file=make_upload()
+        )
+        calls = self.race_for_code(times=1)
+        image = Image.objects.create(
+            product=self.product, name="Second", image_code="pic", image_file=make_upload()
+        )
+        self.assertEqual(calls, ["pic_1", "pic_2"])
+        self.assertEqual(Image.objects.get(pk=image.pk).image_code, "pic_2")
+
+    def test_gives_up_after_retries(self):
+        """A code that stays taken raises after IMAGE_CODE_RETRIES attempts"""
+        Image.objects.create(
+            product=self.product, name="First", image_code="pic", image_file=make_upload()
+        )
+        calls = self.race_for_code(times=IMAGE_CODE_RETRIES)
+        with self.assertRaises(IntegrityError):
+            Image.objects.create(
+                product=self.product,
+                name="Second",
+                image_code="pic",
+                image_file=make_upload(),
+            )
+        self.assertEqual(len(calls), IMAGE_CODE_RETRIES)
+        self.assertFalse(Image.objects.filter(name="Second").exists())
+
+    def test_other_integrity_errors_are_raised(self):
+        """An IntegrityError unrelated to the code is raised without retrying"""
+        image = Image(product=self.product, name=None, image_code="pic")
+        image.image_file = make_upload()
+        with self.assertRaisesMessage(IntegrityError, "NOT NULL"):
+            image.save()
+        self.assertFalse(Image.objects.exists())
+
+    def test_debug_cursor_translates_integrity_errors(self):
+        """With debug_sql_patch the debug cursor still raises django's IntegrityError"""
+        Image.objects.create(
+            product=self.product, name="First", image_code="pic", image_file=make_upload()
+        )
+        connection.force_debug_cursor = True
+        self.addCleanup(setattr, connection, "force_debug_cursor", False)
+        self.race_for_code(times=1)
+        image = Image.objects.create(
+            product=self.product, name="Second", image_code="pic", image_file=make_upload()
+        )
+        self.assertEqual(image.image_code, "pic_2")
+        with self.assertRaises(IntegrityError):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE images_image SET image_code = %s WHERE id = %s",
+                    ["pic", image.pk],
+                )
+
+
+class StoreImageCodeTest(TestCase):
+    """Test the INSERT ... ON CONFLICT path of StoreImage.save"""
+
+    def setUp(self):
+        user = User.objects.create_user(username="storecodes", password="pw")
+        self.store = Store.objects.create(name="Store Codes", user=user)
+        create_store_tables(self.store.id)
+        category = StoreCategory.objects(self.store.id).create(name="Cat")
+        self.product = StoreProduct.objects(self.store.id).create(
+            category=category, name="Prod"
+        )
+
+    def create_image(self, code):
+        return StoreImage.objects(self.store.id).create(
+            product=self.product,
+            name="Pic",
+            image_file="images/pic.jpg",
+            image_code=code,
+        )
+
+    def stored_code(self, image_id):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT image_code FROM store_{self.store.id}_images WHERE id = ?",
+                [image_id],
+            )
+            return cursor.fetchone()[0]
+
+    def test_conflicts_take_lowest_free_suffix(self):
+        """Taken codes get the lowest free _N suffix and id comes from RETURNING"""
+        first = self.create_image("x")
+        gap_after = self.create_image("x_2")
+        second = self.create_image("x")
+        third = self.create_image("x")
+
+        self.assertEqual(
+            [first.image_code, gap_after.image_code, second.image_code, third.image_code],
+            ["x", "x_2", "x_1", "x_3"],
+        )
+        for image in (first, gap_after, second, third):
+            self.assertIsNotNone(image.id)
+            self.assertEqual(self.stored_code(image.id), image.image_code)
+
+    def test_gives_up_after_retries(self):
+        """A code that stays taken raises instead of looping forever"""
+        self.create_image("x")
+        with mock.patch.object(StoreImage, "unique_image_code", return_value="x"):
+            with self.assertRaisesMessage(IntegrityError, "Could not find a free image code"):
+                self.create_image("x")
+
+
+class StoreQuerySetTest(TestCase):
+    """Test that StoreQuerySet fetches lazily and only what it needs"""
+
+    def setUp(self):
+        user = User.objects.create_user(username="querysets", password="pw")
+        store = Store.objects.create(name="Query Store", user=user)
+        create_store_tables(store.id)
+        self.categories = StoreCategory.objects(store.id)
+        for name in ("a", "b", "c", "d", "e"):
+            self.categories.create(name=name)
+
+    def names(self, objs):
+        return [obj.name for obj in objs]
+
+    def selects(self, statements):
+        return [sql for sql in statements if sql.startswith("SELECT")]
+
+    def test_slicing_uses_limit_offset(self):
+        """Slices and indexes become LIMIT/OFFSET instead of loading every row"""
+        statements = trace_sql(self)
+        self.assertEqual(self.names(self.categories.all()[1:3]), ["b", "c"])
+        self.assertEqual(self.categories.all()[3].name, "d")
+        self.assertEqual(self.names(self.categories.all()[2:]), ["c", "d", "e"])
+        with self.assertRaises(IndexError):
+            self.categories.all()[5]
+
+        selects = self.selects(statements)
+        self.assertEqual(len(selects), 4)
+        self.assertTrue(selects[0].endswith("LIMIT 2 OFFSET 1"))
+        self.assertTrue(selects[1].endswith("LIMIT 1 OFFSET 3"))
+        self.assertTrue(selects[2].endswith("LIMIT -1 OFFSET 2"))
+
+    def test_negative_and_stepped_indexes_act_like_lists(self):
+        """Negative and stepped indexes load and cache all results, like a list"""
+        queryset = self.categories.all()
+        statements = trace_sql(self)
+        self.assertEqual(queryset[-1].name, "e")
+        self.assertEqual(self.names(queryset[::2]), ["a", "c", "e"])
+        self.assertEqual(self.names(queryset[-2:]), ["d", "e"])
+        self.assertEqual(len(self.selects(statements)), 1)
+        self.assertNotIn("LIMIT", statements[0])
+
+    def test_count_first_exists(self):
+        """count(), first() and exists() run their own small queries"""
+        statements = trace_sql(self)
+        self.assertEqual(self.categories.all().count(), 5)
+        self.assertEqual(self.categories.all().first().name, "a")
+        self.assertTrue(self.categories.filter(name="c").exists())
+        self.assertFalse(self.categories.filter(name="z").exists())
+        self.assertIsNone(self.categories.filter(name="z").first())
+
+        selects = self.selects(statements)
+        self.assertTrue(selects[0].startswith("SELECT COUNT(*)"))
+        self.assertTrue(selects[1].endswith("LIMIT 1 OFFSET 0"))
+        self.assertTrue(selects[2].startswith("SELECT 1 ") and selects[2].endswith("LIMIT 1"))
+
+    def test_chained_filters_merge(self):
+        """Chained filter() calls run as one query with both conditions"""
+        statements = trace_sql(self)
+        queryset = self.categories.filter(name__in=["a", "b", "c"]).filter(
+            name__icontains="b"
+        )
+        self.assertEqual(statements, [])
+        self.assertEqual(self.names(queryset), ["b"])
+        selects = self.selects(statements)
+        self.assertEqual(len(selects), 1)
+        self.assertIn("name IN ('a', 'b', 'c') AND name LIKE '%b%'", selects[0])
+
+    def test_results_are_cached(self):
+        """Once evaluated, iteration, len(), indexing and count() reuse the results"""
+        queryset = self.categories.all()
+        statements = trace_sql(self)
+        self.assertEqual(len(queryset), 5)
+        self.assertEqual(self.names(queryset), ["a", "b", "c", "d", "e"])
+        self.assertEqual(queryset[1:3][0].name, "b")
+        self.assertEqual(queryset.count(), 5)
+        self.assertTrue(queryset.exists())
+        self.assertEqual(queryset.first().name, "a")
+        self.assertEqual(len(self.selects(statements)), 1)
+
+
+class BulkInsertTest(TestCase):
+    """Test the managers' bulk_create"""
+
+    def setUp(self):
+        user = User.objects.create_user(username="bulkuser", password="pw")
+        store = Store.objects.create(name="Bulk Store", user=user)
+        create_store_tables(store.id)
+        self.manager = StoreCategoryManager(store.id)
+
+    def test_bulk_create_inserts_rows(self):
+        """All rows are inserted with their timestamps set"""
+        self.manager.bulk_create([{"name": "a"}, {"name": "b"}, {"name": "c"}])
+        rows = self.manager.all()
+        self.assertEqual([row["name"] for row in rows], ["a", "b", "c"])
+        self.assertTrue(all(row["created_at"] and row["updated_at"] for row in rows))
+
+    def test_failing_row_rolls_back_all(self):
+        """A row the database rejects leaves none of the rows inserted"""
+        with self.assertRaises(IntegrityError):
+            self.manager.bulk_create([{"name": "a"}, {"name": None}])
+        self.assertEqual(self.manager.all(), [])
+
+    def test_unknown_keys_are_rejected(self):
+        """Keys that aren't writable columns raise before any SQL runs"""
+        for key in ("bogus", "name) VALUES (1); DROP TABLE x --", "created_at"):
+            with self.subTest(key=key), self.assertRaises(ValueError):
+                self.manager.bulk_create([{key: "a"}])
+
+    def test_inconsistent_keys_are_rejected(self):
+        """Rows must all have the keys of the first row"""
+        with self.assertRaises(ValueError):
+            self.manager.bulk_create([{"name": "a"}, {}])
+        with self.assertRaises(ValueError):
+            self.manager.bulk_create([{"name": "a"}, {"name": "b", "id": 9}])
+        self.assertEqual(self.manager.all(), [])
+
+
+class StoreFilterValidationTest(TestCase):
+    """Test that filter keywords can't inject SQL and don't depend on order"""
+
+    def setUp(self):
+        user = User.objects.create_user(username="filteruser", password="pw")
+        self.store = Store.objects.create(name="Filter Store", user=user)
+        create_store_tables(self.store.id)
+
+    def test_unknown_fields_raise(self):
+        """Keywords that aren't columns raise ValueError instead of reaching the SQL"""
+        store_id = self.store.id
+        injection = {"name; DROP TABLE x --": 1}
+        for manager in (
+            StoreCategory.objects(store_id),
+            StoreProduct.objects(store_id),
+            StoreImage.objects(store_id),
+            StoreCategoryManager(store_id),
+        ):
+            with self.subTest(manager=type(manager).__name__):
+                with self.assertRaises(ValueError):
+                    manager.filter(**injection)
+        with self.assertRaises(ValueError):
+            StoreImage.objects(store_id).exclude(bogus=1)
+        with self.assertRaises(ValueError):
+            StoreImage.objects(store_id).exclude(**injection)
+        self.assertEqual(StoreCategory.objects(store_id).all().count(), 0)
+
+    def test_keyword_order_gives_same_sql(self):
+        """The same filter in any keyword order runs the same SQL"""
+        images = StoreImage.objects(self.store.id)
+        statements = trace_sql(self)
+        list(images.filter(name="a", image_code="b", product_id__in=[1, 2]))
+        list(images.filter(product_id__in=[1, 2], image_code="b", name="a"))
+        list(images.exclude(name="a", image_code="b"))
+        list(images.exclude(image_code="b", name="a"))
+        self.assertEqual(len(statements), 4)
+        self.assertEqual(statements[0], statements[1])
+        self.assertEqual(statements[2], statements[3])
+
+
+class MaintenanceScriptTest(SimpleTestCase):
+    """Test that the plain sqlite3 column scripts run without Django"""
+
+    # (module in images/, function it runs, table suffix, column it adds)
+    SCRIPTS = (
+        ("add_description_column", "add_description_columns", "products", "description"),
+        ("add_price_columns", "add_price_columns", "products", "marked_price"),
+        ("add_url_column", "add_url_column", "images", "url"),
+    )
+
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        self.db_path = os.path.join(tmpdir, "db.sqlite3")
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript(
+            """
+            CREATE TABLE images_store (id INTEGER PRIMARY KEY, name TEXT, created_at DATETIME);
+            INSERT INTO images_store VALUES (1, 'One', '2024-01-01'), (2, 'No Tables', '2024-01-02');
+            CREATE TABLE store_1_products (id INTEGER PRIMARY KEY, category_id INTEGER, name TEXT);
+            CREATE TABLE store_1_images (id INTEGER PRIMARY KEY, product_id INTEGER, name TEXT);
+            """
+        )
+        conn.close()
+
+    def run_script(self, module, function):
+        """Run a script's function in a fresh interpreter with no Django settings"""
+        env = {k: v for k, v in os.environ.items() if k != "DJANGO_SETTINGS_MODULE"}
+        code = "\n".join(
+            [
+                "import sys",
+                f"sys.path.insert(0, {str(project_root)!r})",
+                "import images.sqlite_maintenance as maintenance",
+                f"maintenance.DB_PATH = {self.db_path!r}",
+                f"from images.{module} import {function}",
+                f"{function}()",
+                "assert 'django' not in sys.modules, 'script imported Django'",
+            ]
+        )
+        return subprocess.run(
+            [sys.executable, "-c", code], env=env, capture_output=True, text=True
+        )
+
+    def test_scripts_add_columns_without_django(self):
+        """Each script imports and adds its column with only sqlite3"""
+        for module, function, suffix, column in self.SCRIPTS:
+            with self.subTest(script=module):
+                result = self.run_script(module, function)
+                self.assertEqual(result.returncode, 0, result.stderr)
+                conn = sqlite3.connect(self.db_path)
+                columns = {row[1] for row in conn.execute(f"PRAGMA table_info(store_1_{suffix})")}
+                conn.close()
+                self.assertIn(column, columns)
+
+
+class BackgroundFailureLoggingTest(TempMediaMixin, TestCase):
+    """Test that failures on the compression worker threads are logged"""
+
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user(username="loguser", password="pw")
+        self.store = Store.objects.create(name="Log Store", user=user)
+        # The workers close their connection when done; keep the test's open
+        patcher = mock.patch.object(connection, "close")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_compression_failure_is_logged(self):
+        """compress_stored_image logs the error with its traceback"""
+        category = Category.objects.create(store=self.store, name="Cat")
+        product = Product.objects.create(category=category, name="Prod")
+        image = Image.objects.create(product=product, name="Pic", image_file=make_upload())
+        with mock.patch("images.models.compress_image", side_effect=OSError("disk full")):
+            with self.assertLogs("images.models", "ERROR") as logs:
+                compress_stored_image(Image, image.pk, "image_file")
+        self.assertIn(f"Compression failed for Image {image.pk}.image_file", logs.output[0])
+        self.assertIn("OSError: disk full", logs.output[0])
+
+    def test_store_image_failure_is_logged(self):
+        """process_store_image logs the error with its traceback"""
+        create_store_tables(self.store.id)
+        category = StoreCategory.objects(self.store.id).create(name="Cat")
+        product = StoreProduct.objects(self.store.id).create(category=category, name="Prod")
+        # A PNG, since small JPEGs are kept as uploaded without re-encoding
+        png_io = BytesIO()
+        PILImage.new("RGB", (40, 30), color="blue").save(png_io, format="PNG")
+        upload = SimpleUploadedFile("pic.png", png_io.getvalue(), content_type="image/png")
+        image = StoreImage.objects(self.store.id).create(
+            product=product, name="Pic", image_file=upload
+        )
+        with mock.patch(
+            "images.store_helpers.render_store_image", side_effect=OSError("disk full")
+        ):
+            with self.assertLogs("images.store_helpers", "ERROR") as logs:
+                process_store_image(self.store.id, image.id)
+        self.assertIn(
+            f"Processing failed for store {self.store.id} image {image.id}", logs.output[0]
+        )
+        self.assertIn("OSError: disk full", logs.output[0])
+
+
 def run_tests():
     """Run all tests"""
     import unittest
@@ -453,6 +1110,15 @@ def run_tests():
     # Add test cases
     suite.addTests(loader.loadTestsFromTestCase(StoreTableOrganizationTest))
     suite.addTests(loader.loadTestsFromTestCase(StoreTableIntegrationTest))
+    suite.addTests(loader.loadTestsFromTestCase(ImageSlugSyncTest))
+    suite.addTests(loader.loadTestsFromTestCase(ImageFileDetailsTest))
+    suite.addTests(loader.loadTestsFromTestCase(ImageCodeTest))
+    suite.addTests(loader.loadTestsFromTestCase(StoreImageCodeTest))
+    suite.addTests(loader.loadTestsFromTestCase(StoreQuerySetTest))
+    suite.addTests(loader.loadTestsFromTestCase(BulkInsertTest))
+    suite.addTests(loader.loadTestsFromTestCase(StoreFilterValidationTest))
+    suite.addTests(loader.loadTestsFromTestCase(MaintenanceScriptTest))
+    suite.addTests(loader.loadTestsFromTestCase(BackgroundFailureLoggingTest))
 
     # Run tests
     runner = unittest.TextTestRunner(verbosity=2)